@@ -0,0 +1,206 @@
+"""
+Module to measure the throughput of the decode pipeline on synthetic telemetry
+
+Every case of the matrix of data rates, channel counts and plot_hertz writes a recording and format file with
+TelemetrySynth, then parses the recording with parsing.parse() the way the gui does and with parse_recording().
+The frames/s and MB/s of every stage and end to end are written to a JSON file that compare() reads back.
+run_workers() times parse_recording() of one recording with recording_executor() for each number of workers.
+
+    python benchmark.py --out before.json
+    python benchmark.py --out after.json --compare before.json
+    python benchmark.py --workers 1 2 4 8
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import json, os, platform, sys, tempfile, time
+from datetime import datetime
+
+import numpy as np
+
+import parsing, formatfile
+from synth import TelemetrySynth, PACKET_LENGTH
+
+RATES = [5000, 20000, 80000] # Packets per second
+CHANNELS = [8, 32]
+HERTZ = [5, 20]
+WORKERS = [1, 2, 4]
+
+def run_case(directory, rate, num_channels, hertz, seconds=2.0, seed=0):
+    """
+    Parse seconds of telemetry at rate packets/s and return the frames/s and MB/s of every stage
+    """
+    synth = TelemetrySynth(num_channels, seed=seed)
+    num_packets = int(rate*seconds)
+    recording = os.path.join(directory, f"bench_{rate}_{num_channels}.udp")
+    format_file = os.path.join(directory, f"bench_{rate}_{num_channels}.xlsx")
+    synth.write_recording(recording, num_packets)
+    synth.write_format(format_file, rate*PACKET_LENGTH)
+    size = num_packets*PACKET_LENGTH
+
+    # Streaming, one parse() per cycle
+    parsing.init(format_file, mode=0, read_file_name=recording, hertz=hertz)
+    parsing.sync_lock.verbose = False
+    cycles = 0
+    start_time = time.perf_counter()
+    while parsing.parse() is not None:
+        cycles += 1
+    stream_time = time.perf_counter()-start_time
+    frames = parsing.continuity.stats()["total"]["frames"]
+    stages = {}
+    for stage, total in parsing.timer.total_times().items():
+        stages[stage] = {"seconds": total,
+                         "frames_ps": frames/total if total > 0 else None,
+                         "MB_ps": size/1e6/total if total > 0 else None}
+
+    # Whole recording at once
+    start_time = time.perf_counter()
+    parsing.parse_recording(recording)
+    recording_time = time.perf_counter()-start_time
+    recording_frames = parsing.continuity.stats()["total"]["frames"]
+
+    os.remove(recording)
+    os.remove(format_file)
+    return {"rate": rate,
+            "channels": num_channels,
+            "hertz": hertz,
+            "packets": num_packets,
+            "bytes": size,
+            "cycles": cycles,
+            "stream": {"seconds": stream_time,
+                       "frames": frames,
+                       "frames_ps": frames/stream_time,
+                       "MB_ps": size/1e6/stream_time,
+                       "realtime": num_packets/rate/stream_time, # Seconds of telemetry parsed per second
+                       "stages": stages},
+            "recording": {"seconds": recording_time,
+                          "frames": recording_frames,
+                          "frames_ps": recording_frames/recording_time,
+                          "MB_ps": size/1e6/recording_time}}
+
+def run(rates=RATES, channels=CHANNELS, hertz=HERTZ, seconds=2.0, label=""):
+    results = {"meta": {"label": label,
+                        "time": datetime.now().isoformat(timespec="seconds"),
+                        "python": sys.version.split()[0],
+                        "numpy": np.__version__,
+                        "platform": platform.platform(),
+                        "processor": platform.processor(),
+                        "seconds": seconds},
+               "cases": []}
+    with tempfile.TemporaryDirectory() as directory:
+        # The formats only exist for one case, so they are not kept in the format cache
+        cache_dir, formatfile.CACHE_DIR = formatfile.CACHE_DIR, os.path.join(directory, "formats")
+        try:
+            for rate in rates:
+                for num_channels in channels:
+                    for h in hertz:
+                        case = run_case(directory, rate, num_channels, h, seconds)
+                        results["cases"].append(case)
+                        print(f"{rate:7d} pkt/s {num_channels:4d} ch {h:4d} Hz   "
+                              f"stream {case['stream']['MB_ps']:7.1f} MB/s {case['stream']['frames_ps']:10.0f} frames/s "
+                              f"({case['stream']['realtime']:6.1f}x realtime)   "
+                              f"recording {case['recording']['MB_ps']:7.1f} MB/s")
+        finally:
+            formatfile.CACHE_DIR = cache_dir
+    return results
+
+def run_workers(workers=WORKERS, rate=80000, num_channels=32, seconds=10.0, seed=0):
+    """
+    Parse one recording with parse_recording() in this process and with recording_executor() of each number of
+    workers, returns the MB/s and the speedup over this process of each
+    """
+    synth = TelemetrySynth(num_channels, seed=seed)
+    num_packets = int(rate*seconds)
+    size = num_packets*PACKET_LENGTH
+    results = {"cpus": os.cpu_count(), "packets": num_packets, "bytes": size, "runs": []}
+    with tempfile.TemporaryDirectory() as directory:
+        cache_dir, formatfile.CACHE_DIR = formatfile.CACHE_DIR, os.path.join(directory, "formats")
+        try:
+            recording = os.path.join(directory, "bench_workers.udp")
+            format_file = os.path.join(directory, "bench_workers.xlsx")
+            synth.write_recording(recording, num_packets)
+            synth.write_format(format_file, rate*PACKET_LENGTH)
+            parsing.init(format_file, mode=2)
+
+            start_time = time.perf_counter()
+            parsing.parse_recording(recording)
+            serial_time = time.perf_counter()-start_time
+            print(f"{size/1e6:7.1f} MB on {results['cpus']} cores   this process {size/1e6/serial_time:7.1f} MB/s")
+            for num in workers:
+                executor = parsing.recording_executor(num)
+                # Start the processes and load the format file in them before timing
+                list(executor.map(abs, range(num)))
+                start_time = time.perf_counter()
+                parsing.parse_recording(recording, executor=executor)
+                run_time = time.perf_counter()-start_time
+                executor.shutdown()
+                results["runs"].append({"workers": num,
+                                        "seconds": run_time,
+                                        "MB_ps": size/1e6/run_time,
+                                        "speedup": serial_time/run_time})
+                print(f"{num:4d} workers   {size/1e6/run_time:7.1f} MB/s   speedup {serial_time/run_time:5.2f}x")
+            results["serial"] = {"seconds": serial_time, "MB_ps": size/1e6/serial_time}
+        finally:
+            formatfile.CACHE_DIR = cache_dir
+    return results
+
+def print_stages(results):
+    """
+    Table of the MB/s of every stage of each case
+    """
+    cases = results["cases"]
+    if not cases:
+        return
+    stages = list(cases[0]["stream"]["stages"])
+    print(f"{'case':>22}"+"".join(f"{stage:>13}" for stage in stages))
+    for case in cases:
+        row = f"{case['rate']:>7}/{case['channels']:>4}ch/{case['hertz']:>3}Hz"
+        for stage in stages:
+            MB_ps = case["stream"]["stages"][stage]["MB_ps"]
+            row += f"{MB_ps:13.1f}" if MB_ps is not None else f"{'-':>13}"
+        print(f"{row:>22}")
+
+def compare(old_results, new_results):
+    """
+    Print the speedup of every case of new_results over the same case in old_results
+    """
+    old_cases = {(case["rate"], case["channels"], case["hertz"]):case for case in old_results["cases"]}
+    print(f"{old_results['meta']['label'] or 'old'} -> {new_results['meta']['label'] or 'new'}")
+    for case in new_results["cases"]:
+        old = old_cases.get((case["rate"], case["channels"], case["hertz"]))
+        if old is None:
+            continue
+        stages = ", ".join(f"{stage} {info['MB_ps']/old['stream']['stages'][stage]['MB_ps']:.2f}x"
+                           for stage, info in case["stream"]["stages"].items()
+                           if info["MB_ps"] and old["stream"]["stages"].get(stage, {}).get("MB_ps"))
+        print(f"{case['rate']:7d} pkt/s {case['channels']:4d} ch {case['hertz']:4d} Hz   "
+              f"stream {case['stream']['MB_ps']/old['stream']['MB_ps']:.2f}x   "
+              f"recording {case['recording']['MB_ps']/old['recording']['MB_ps']:.2f}x   ({stages})")
+
+if __name__ == "__main__":
+    import argparse
+    arg_parser = argparse.ArgumentParser(description="Measure the throughput of the decode pipeline on synthetic telemetry")
+    arg_parser.add_argument("--rates", type=int, nargs="+", default=RATES, help="Packets per second")
+    arg_parser.add_argument("--channels", type=int, nargs="+", default=CHANNELS, help="Number of channels")
+    arg_parser.add_argument("--hertz", type=int, nargs="+", default=HERTZ, help="plot_hertz, the parse() calls per second of telemetry")
+    arg_parser.add_argument("--seconds", type=float, default=2.0, help="Seconds of telemetry in each case")
+    arg_parser.add_argument("--label", default="", help="Name of this run, like a version or commit")
+    arg_parser.add_argument("-o", "--out", default="", help="JSON file to write the results to")
+    arg_parser.add_argument("--compare", default="", help="JSON file of an earlier run to compare against")
+    arg_parser.add_argument("--workers", type=int, nargs="*", help="Only time parse_recording() with these numbers of worker processes")
+    args = arg_parser.parse_args()
+
+    if args.workers is not None:
+        results = run_workers(args.workers or WORKERS, max(args.rates), max(args.channels), args.seconds)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(results, f, indent=1)
+        sys.exit()
+
+    results = run(args.rates, args.channels, args.hertz, args.seconds, args.label)
+    print_stages(results)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
@@ -0,0 +1,187 @@
+"""
+Module with preallocated buffers for incoming data
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import numpy as np
+
+class ByteRing:
+    """
+    Fixed size uint8 buffer that files and sockets read into directly.
+
+    New bytes are always written after the bytes that have not been consumed yet, so the partial
+    frame carried over to the next cycle stays where it is. The unconsumed bytes are only moved to
+    the front of the buffer when there is not enough room left at the end.
+    """
+    def __init__(self, capacity):
+        self.buffer = np.zeros(capacity, dtype=np.uint8)
+        self.start = 0      # First byte that has not been consumed
+        self.end = 0        # End of the written bytes
+        self.dropped = 0    # Bytes thrown away because the buffer was full
+
+    def __len__(self):
+        return self.end-self.start
+
+    def capacity(self):
+        return len(self.buffer)
+
+    def compact(self):
+        """
+        Move the unconsumed bytes to the front of the buffer
+        """
+        if self.start == 0:
+            return
+        n = self.end-self.start
+        self.buffer[:n] = self.buffer[self.start:self.end]
+        self.start, self.end = 0, n
+
+    def writable(self, n):
+        """
+        Returns a view of the buffer where the next n bytes can be written, followed by commit()
+        """
+        if n > len(self.buffer):
+            raise ValueError(f"Can not write {n} bytes to a ByteRing of {len(self.buffer)} bytes")
+        if self.end+n > len(self.buffer):
+            self.compact()
+        if self.end+n > len(self.buffer):
+            # Not enough room even after compacting, drop the oldest bytes
+            drop = int(self.end+n-len(self.buffer))
+            self.dropped += drop
+            self.start += drop
+            self.compact()
+        return self.buffer[self.end:self.end+n]
+
+    def commit(self, n):
+        """
+        Mark n bytes written to writable() as data
+        """
+        self.end += n
+
+    def readinto(self, file, n):
+        """
+        Read up to n bytes from a file into the buffer, returns the number of bytes read
+        """
+        num = file.readinto(memoryview(self.writable(n))) or 0
+        self.commit(num)
+        return num
+
+    def view(self):
+        """
+        The unconsumed bytes, without copying them
+        """
+        return self.buffer[self.start:self.end]
+
+    def latest(self, n):
+        """
+        The last n bytes written
+        """
+        return self.buffer[self.end-n:self.end]
+
+    def consume(self, n):
+        """
+        Mark the first n unconsumed bytes as used, consumed bytes can not be given back
+        """
+        if n < 0:
+            raise ValueError(f"Can not consume {n} bytes")
+        self.start = min(self.start+n, self.end)
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def clear(self):
+        self.start = self.end = 0
+
+class CircularBuffer:
+    """
+    History of the last length values, written at a cursor instead of shifting with np.roll.
+
+    Values are stored along the last axis, so rows can hold several values that are written together.
+    The oldest value is at the cursor, so the history in order is the two contiguous segments
+    data[..., cursor:] and data[..., :cursor].
+    """
+    def __init__(self, length, rows=None, dtype=np.float64, buffer=None):
+        if buffer is None:
+            buffer = np.zeros(length if rows is None else (rows, length), dtype=dtype)
+        self.data = buffer
+        self.length = length
+        self.cursor = 0 # Next index to write, which is the oldest value
+        self.index = None
+
+    def __len__(self):
+        return self.length
+
+    def write(self, values):
+        """
+        Add values to the end of the history
+        Returns the (start, end) ranges of data that were written, so copies of data can be updated in place
+        """
+        n = np.shape(values)[-1]
+        if n == 0:
+            return []
+        if n >= self.length:
+            self.data[...] = values[..., n-self.length:]
+            self.cursor = 0
+            return [(0, self.length)]
+
+        start, end = self.cursor, self.cursor+n
+        if end <= self.length:
+            self.data[..., start:end] = values
+            written = [(start, end)]
+        else:
+            first = self.length-start
+            self.data[..., start:] = values[..., :first]
+            self.data[..., :n-first] = values[..., first:]
+            written = [(start, self.length), (0, n-first)]
+        self.cursor = end % self.length
+        return written
+
+    def segments(self):
+        """
+        The history in order as two views, oldest first
+        """
+        return self.data[..., self.cursor:], self.data[..., :self.cursor]
+
+    def ordered(self):
+        """
+        Copy of the history in order
+        """
+        return np.concatenate(self.segments(), axis=-1)
+
+    def latest(self, n):
+        """
+        The last n values in order, only copied when they wrap around the end of the buffer
+        """
+        n = min(n, self.length)
+        if n <= self.cursor:
+            return self.data[..., self.cursor-n:self.cursor]
+        return np.concatenate([self.data[..., self.length-(n-self.cursor):], self.data[..., :self.cursor]], axis=-1)
+
+    def oldest(self, n):
+        """
+        The first n values in order, only copied when they wrap around the end of the buffer
+        """
+        n = min(n, self.length)
+        if self.cursor+n <= self.length:
+            return self.data[..., self.cursor:self.cursor+n]
+        return np.concatenate([self.data[..., self.cursor:], self.data[..., :n-(self.length-self.cursor)]], axis=-1)
+
+    def last(self):
+        """
+        The most recent value
+        """
+        return self.data[..., self.cursor-1]
+
+    def positions(self, out=None):
+        """
+        Position of every stored value in the ordered history, 0 being the oldest
+        """
+        if self.index is None:
+            self.index = np.arange(self.length)
+        if out is None:
+            out = np.empty(self.length, dtype=np.float64)
+        np.subtract(self.index, self.cursor, out=out, casting='unsafe')
+        np.mod(out, self.length, out=out)
+        return out
+
+    def fill(self, value=0):
+        self.data.fill(value)
+        self.cursor = 0
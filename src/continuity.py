@@ -0,0 +1,65 @@
+"""
+Module to check that the frame counter of the minor frames is continuous
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import numpy as np
+
+COUNTS = ["frames", "dropped", "duplicate", "out_of_order", "malformed"]
+
+class ContinuityTracker:
+    """
+    Counts dropped, duplicate, out of order and malformed frames from the frame counter of every batch
+
+    The counter wraps at modulus, steps of less than half of modulus backwards are frames that arrived late.
+    Every frame is compared to the highest counter seen before it, so gaps are counted in dropped when they
+    are seen and a frame behind that counter is counted in out_of_order, whether it arrived late or its
+    counter was corrupted. The last counter is carried over so gaps between batches are counted.
+    """
+    def __init__(self, modulus=256):
+        self.modulus = modulus
+        self.last = None # Last counter
+        self.top = 0     # Highest counter seen, relative to last
+        self.total = dict.fromkeys(COUNTS, 0)
+        self.batch = dict.fromkeys(COUNTS, 0)
+
+    def update(self, counters, malformed=0):
+        """
+        Count the frames of a batch from their counters in the order they arrived
+        malformed is the number of SYNC frames that were thrown away without being checked
+        """
+        counters = np.asarray(counters, dtype=np.int64)
+        self.batch = dict.fromkeys(COUNTS, 0)
+        self.batch["frames"] = len(counters)
+        self.batch["malformed"] = int(malformed)
+
+        if len(counters) > 0:
+            if self.last is None:
+                self.last = counters[0]-1
+
+            # Signed steps between frames, wrapped into [-modulus/2, modulus/2)
+            half = self.modulus//2
+            steps = (np.diff(counters, prepend=self.last)+half) % self.modulus - half
+            unwrapped = np.cumsum(steps)
+            tops = np.maximum.accumulate(np.concatenate([[self.top], unwrapped]))
+            ahead = unwrapped-tops[:-1]
+
+            self.batch["dropped"] = int(np.sum(ahead[ahead > 1]-1))
+            self.batch["duplicate"] = int(np.count_nonzero(steps == 0))
+            self.batch["out_of_order"] = int(np.count_nonzero((ahead <= 0) & (steps != 0)))
+
+            self.top = int(tops[-1]-unwrapped[-1])
+            self.last = int(counters[-1])
+
+        for key in COUNTS:
+            self.total[key] += self.batch[key]
+        return self.batch
+
+    def stats(self):
+        return {"total": dict(self.total), "batch": dict(self.batch)}
+
+    def reset(self):
+        self.last = None
+        self.top = 0
+        self.total = dict.fromkeys(COUNTS, 0)
+        self.batch = dict.fromkeys(COUNTS, 0)
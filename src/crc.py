@@ -0,0 +1,78 @@
+"""
+Module for the CRC-16 checksum of GPS RV packets
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import time
+
+import numpy as np
+
+CRC_POLY = 0x1021
+# RV packets are checked over the first 45 bytes, the checksum is stored little endian in bytes 45 and 46
+RV_CRC_LEN = 45
+
+def crc_16(arr):
+    """
+    Checksum for gps data, computed one bit at a time
+    """
+    crc = 0
+    for i in arr:
+        crc ^= (i<<8)
+        for i in range(0,8):
+            if (crc&0x8000)>0:
+                crc <<= 1
+                crc ^= CRC_POLY
+            else:
+                crc <<= 1
+        crc &= (1<<16)-1
+    return crc
+
+# crc of every single byte, so a whole byte can be added to the checksum at once
+CRC_TABLE = np.array([crc_16([byte]) for byte in range(256)], dtype=np.uint32)
+
+def crc_16_rows(matrix):
+    """
+    Checksum of every row of a (packets, bytes) matrix at once
+    """
+    matrix = np.asarray(matrix)
+    crc = np.zeros(matrix.shape[0], dtype=np.uint32)
+    # One table lookup per byte column for all of the rows
+    for col in range(matrix.shape[1]):
+        crc = ((crc << 8) ^ CRC_TABLE[(crc >> 8) ^ (matrix[:, col] & 0xFF)]) & 0xFFFF
+    return crc
+
+def check_rv_packets(gpsmatrix):
+    """
+    Returns a mask of the RV packets (rows of gpsmatrix) whose checksum is equal to the stored checksum
+    """
+    gpsmatrix = np.asarray(gpsmatrix)
+    if gpsmatrix.shape[0] == 0:
+        return np.zeros(0, dtype=bool)
+    crc = crc_16_rows(gpsmatrix[:, :RV_CRC_LEN])
+    stored = (gpsmatrix[:, RV_CRC_LEN+1].astype(np.uint32) << 8) | gpsmatrix[:, RV_CRC_LEN]
+    return crc == stored
+
+if __name__ == "__main__":
+    # Micro-benchmark of the bitwise checksum loop against the table checksum
+    rng = np.random.default_rng(0)
+    for num_RV in [10, 100, 1000]:
+        gpsmatrix = rng.integers(0, 256, (num_RV, 48), dtype=np.uint32)
+        # Give half of the packets a correct checksum
+        for i in range(0, num_RV, 2):
+            crc = crc_16(gpsmatrix[i, :RV_CRC_LEN])
+            gpsmatrix[i, RV_CRC_LEN], gpsmatrix[i, RV_CRC_LEN+1] = crc & 0xFF, crc >> 8
+
+        start_time = time.perf_counter()
+        loop_valid = np.zeros(num_RV, dtype=bool)
+        for i in range(num_RV):
+            loop_valid[i] = crc_16(gpsmatrix[i,:-3]) == (gpsmatrix[i, -2]<<8) | gpsmatrix[i, -3]
+        loop_time = time.perf_counter()-start_time
+
+        reps = 100
+        start_time = time.perf_counter()
+        for _ in range(reps):
+            table_valid = check_rv_packets(gpsmatrix)
+        table_time = (time.perf_counter()-start_time)/reps
+
+        assert np.array_equal(loop_valid, table_valid)
+        print(f"{num_RV:5d} packets   loop {loop_time*1e3:9.3f} ms   table {table_time*1e3:7.3f} ms   speedup {loop_time/table_time:7.1f}x")
@@ -0,0 +1,86 @@
+"""
+Module to reduce channel histories to the min and max of every pixel column
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import numpy as np
+
+from buffers import CircularBuffer
+
+class MinMaxDecimator:
+    """
+    Min and max of every step values of a CircularBuffer history, updated as values are written
+
+    Bins are counted from the first value of the history, so a bin holds the same values while the history
+    scrolls and writing only changes the newest bin, adds new ones and computes the oldest bin again from the values
+    that did not scroll out. The bins are only computed from the whole history again when the step changes. The zeros the history starts with count as values.
+    The bins are stored in order of time in a CircularBuffer of num_bins, envelope[slot] is [min, max].
+    """
+    def __init__(self, history, step=1):
+        self.history = history
+        self.total = len(history) # Values written to the history so far
+        self.set_step(step)
+
+    def set_step(self, step):
+        """
+        Compute the bins from the whole history with step values per bin
+        Returns the slots of the bins that changed like CircularBuffer.write()
+        """
+        self.step = max(int(step), 1)
+        self.num_bins = -(-len(self.history)//self.step)+1 # Enough bins for a history that does not start a bin
+        self.envelope = np.zeros((self.num_bins, 2), dtype=np.float32)
+        self.bins = CircularBuffer(self.num_bins, buffer=self.envelope.T)
+
+        # Start of every bin in the ordered history, the oldest bin can start before the history
+        first = self.total-len(self.history)
+        first_bin, last_bin = first//self.step, (self.total-1)//self.step
+        starts = np.maximum(np.arange(first_bin, last_bin+1)*self.step-first, 0)
+        ordered = self.history.ordered()
+        self.bins.write(np.stack([np.minimum.reduceat(ordered, starts), np.maximum.reduceat(ordered, starts)]))
+        self.fill = self.total-last_bin*self.step # Values in the newest bin
+        return [(0, self.num_bins)]
+
+    def write(self, values):
+        """
+        Add values that were just written to the history
+        Returns the slots of the bins that changed like CircularBuffer.write()
+        """
+        n = len(values)
+        if n == 0:
+            return []
+        if n >= len(self.history):
+            self.total += n
+            return self.set_step(self.step)
+
+        # The newest bin is finished first, then the rest start new bins
+        written = []
+        k = min(self.step-self.fill, n)
+        if k > 0:
+            slot = (self.bins.cursor-1) % self.num_bins
+            self.envelope[slot, 0] = min(self.envelope[slot, 0], values[:k].min())
+            self.envelope[slot, 1] = max(self.envelope[slot, 1], values[:k].max())
+            self.fill += k
+            written.append((slot, slot+1))
+        rest = values[k:]
+        if len(rest) > 0:
+            starts = np.arange(0, len(rest), self.step)
+            written += self.bins.write(np.stack([np.minimum.reduceat(rest, starts), np.maximum.reduceat(rest, starts)]))
+            self.fill = len(rest)-starts[-1]
+        self.total += n
+
+        # Values scrolled out of the oldest bin, so it is computed again from the ones left in the history
+        first = self.total-len(self.history)
+        left = self.step-first % self.step
+        if left < self.step:
+            slot = (self.bins.cursor-1-((self.total-1)//self.step-first//self.step)) % self.num_bins
+            oldest = self.history.oldest(left)
+            self.envelope[slot] = oldest.min(), oldest.max()
+            written.append((slot, slot+1))
+        return written
+
+    def offset(self):
+        """
+        Position in the history of the first value of the oldest bin, which is at the cursor of bins
+        """
+        last_bin = (self.total-1)//self.step
+        return (last_bin-self.num_bins+1)*self.step-(self.total-len(self.history))
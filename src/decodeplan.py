@@ -0,0 +1,75 @@
+"""
+Module to decode every channel of a protocol at once
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import numpy as np
+
+COMPACT_DTYPES = [np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32, np.int64]
+
+class DecodePlan:
+    """
+    Tables of every (byte index, mask, shift) of a list of channels
+
+    Built once after the format file is loaded. decode() gathers all of the bytes of every channel
+    from the minor frames in one pass and returns a (channels, frames) block, so each channel's
+    values are a single row of the block.
+    The channels must have byte_info as a list of [ind, mask, shift], signed and ylims.
+    """
+    def __init__(self, channels):
+        self.channels = list(channels)
+
+        cols, masks, lshift, rshift, starts = [], [], [], [], []
+        for channel in self.channels:
+            starts.append(len(cols))
+            for ind, mask, shift in channel.byte_info:
+                cols.append(ind)
+                masks.append(mask)
+                lshift.append(max(shift, 0))
+                rshift.append(max(-shift, 0))
+
+        self.cols = np.array(cols, dtype=np.intp)
+        self.masks = np.array(masks, dtype=np.int64)[:, None]
+        self.lshift = np.array(lshift, dtype=np.int64)[:, None]
+        self.rshift = np.array(rshift, dtype=np.int64)[:, None]
+        self.starts = np.array(starts, dtype=np.intp)
+        # Channels without any bytes are left at 0
+        self.empty = np.array([len(channel.byte_info) == 0 for channel in self.channels], dtype=bool)
+
+        # Signed values at or above the top limit wrap around to negative
+        self.signed = np.array([channel.signed for channel in self.channels], dtype=bool)
+        self.sign_limit = np.array([channel.ylims[1] for channel in self.channels], dtype=np.int64)[:, None]
+        self.sign_wrap = (self.signed*2*self.sign_limit[:, 0])[:, None]
+
+        # Smallest dtype that holds the values of every channel, blocks are sent between processes in it
+        low = min([int(channel.ylims[0]) for channel in self.channels], default=0)
+        high = max([int(channel.ylims[1])-1 for channel in self.channels], default=0)
+        self.dtype = next(np.dtype(t) for t in COMPACT_DTYPES if np.iinfo(t).min <= low and high <= np.iinfo(t).max)
+
+    def __len__(self):
+        return len(self.channels)
+
+    def decode(self, minframes, rows=None):
+        """
+        Returns the values of every channel as a (channels, frames) block
+        rows selects the frames of the protocol from minframes, all frames are used when it is None
+        """
+        minframes = np.asarray(minframes)
+        num_frames = len(minframes) if rows is None else len(rows)
+        if len(self.channels) == 0 or len(self.cols) == 0:
+            return np.zeros((len(self.channels), num_frames), dtype=np.int64)
+
+        # (bytes, frames) so the rows that are summed together are next to each other
+        if rows is None:
+            values = minframes[:, self.cols].T.astype(np.int64)
+        else:
+            values = minframes[np.ix_(rows, self.cols)].T.astype(np.int64)
+        values &= self.masks
+        values <<= self.lshift
+        values >>= self.rshift
+
+        block = np.zeros((len(self.channels), values.shape[1]), dtype=np.int64)
+        block[~self.empty] = np.add.reduceat(values, self.starts[~self.empty], axis=0)
+        if self.signed.any():
+            block -= (block >= self.sign_limit)*self.sign_wrap
+        return block
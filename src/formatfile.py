@@ -0,0 +1,114 @@
+"""
+Module to load the excel instrument format files
+
+The sheet is read once with openpyxl in read only mode and compiled into a dictionary of typed rows
+    bytes_ps       D3
+    graphs         rows of GRAPH_ROW_TYPE from the range in D6
+    channels       rows of CHANNEL_ROW_TYPE from the range in D7
+    maps           rows of MAP_ROW_TYPE from the range in D8
+    housekeeping   rows of HK_ROW_TYPE from the range in D9
+Each row starts at column C. The compiled format is cached as JSON under the path of the format file and
+stored with its mtime and hash, so later loads do not import openpyxl or read the sheet.
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import hashlib, json, os
+from os.path import dirname, abspath
+
+# The type of values in the excel sheet
+GRAPH_ROW_TYPE =   [str, str, int,  int,  str, str, int]
+CHANNEL_ROW_TYPE = [str, str, bool, list, list]
+MAP_ROW_TYPE =     [str, str, int,  int,  str]
+HK_ROW_TYPE =      [str, int, str,  int,  list, list, bool, bool, bool, bool, bool, bool, bool, bool, bool, bool, bool]
+
+# (name, cell with the range of rows, row type)
+SECTIONS = [("graphs", "D6", GRAPH_ROW_TYPE),
+            ("channels", "D7", CHANNEL_ROW_TYPE),
+            ("maps", "D8", MAP_ROW_TYPE),
+            ("housekeeping", "D9", HK_ROW_TYPE)]
+FIRST_COL = 2 # Column C
+
+CACHE_DIR = dirname(dirname(abspath(__file__)))+"/cache/formats"
+CACHE_VERSION = 1 # Increase when the compiled format changes
+
+def convert(val, t):
+    """
+    Value of a cell as type t, lists are numbers separated by ;
+    Other types are kept as they are in the sheet like getval() did
+    """
+    if t == list:
+        return [int(i) for i in str(val).split(';')]
+    return val
+
+def cell(rows, name):
+    """
+    Value of a cell like "D3" from the rows of a sheet
+    """
+    row, col = int(name[1:])-1, ord(name[0])-ord('A')
+    if row >= len(rows) or col >= len(rows[row]):
+        return None
+    return rows[row][col]
+
+def compile_format(file_name):
+    """
+    Read a format file with openpyxl and return the compiled format
+    """
+    from openpyxl import load_workbook
+    workbook = load_workbook(file_name, read_only=True, data_only=True)
+    # Read only sheets are slow to index, so every row is read once
+    rows = list(workbook.active.iter_rows(min_row=1, min_col=1, values_only=True))
+    workbook.close()
+
+    compiled = {"bytes_ps": cell(rows, "D3")}
+    for section, range_cell, row_type in SECTIONS:
+        compiled[section] = []
+        row_range = cell(rows, range_cell)
+        if row_range is None:
+            continue
+        first, last = convert(row_range, list)
+        for row_num in range(first, last+1):
+            row = [cell(rows, chr(ord('A')+FIRST_COL+i)+str(row_num)) for i in range(len(row_type))]
+            compiled[section].append([convert(val, t) for val, t in zip(row, row_type)])
+    return compiled
+
+def file_hash(file_name):
+    with open(file_name, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def cache_name(file_name):
+    return os.path.join(CACHE_DIR, hashlib.sha1(abspath(file_name).encode()).hexdigest()+".json")
+
+def load_format(file_name, use_cache=True):
+    """
+    Compiled format of a format file, from the cache when the file has not changed
+    A file with a new mtime is only compiled again when its hash changed too
+    """
+    mtime = os.path.getmtime(file_name)
+    cache_file = cache_name(file_name)
+    cached = None
+    if use_cache and os.path.exists(cache_file):
+        try:
+            with open(cache_file) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = None
+        if cached is not None and cached.get("version") != CACHE_VERSION:
+            cached = None
+
+    if cached is not None and cached["mtime"] == mtime:
+        return cached["format"]
+
+    digest = file_hash(file_name)
+    if cached is not None and cached["hash"] == digest:
+        compiled = cached["format"]
+    else:
+        compiled = compile_format(file_name)
+
+    if use_cache:
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(cache_file, "w") as f:
+                json.dump({"version": CACHE_VERSION, "path": abspath(file_name), "mtime": mtime, "hash": digest, "format": compiled}, f, default=str)
+        except OSError as e:
+            print(f"Could not cache format file: {e}")
+    return compiled
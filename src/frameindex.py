@@ -0,0 +1,236 @@
+"""
+Module for the sidecar index files of udp recordings
+
+The index of "name.udp" is kept next to it in two files:
+    name.udp.idx   one FRAME_DTYPE record for every minor frame
+    name.udp.tidx  one TIME_DTYPE record about every marker_period seconds
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import os, threading, time
+
+import numpy as np
+
+from sync import SYNC, find_SYNC
+
+PACKET_LENGTH = 2 * 40 + 44
+SFID_BYTE = 6   # SFID byte after the start of the SYNC frame, also the counter checked between frames
+FRAME_BYTE = 58 # Byte with the odd/even frame bits (byte 57 after swapping endianness)
+
+# offset: byte offset of the SYNC frame in the recording
+FRAME_DTYPE = np.dtype([('offset', '<u8'), ('sfid', 'u1'), ('frame_id', 'u1')])
+# frame: number of frames that were indexed before the marker
+TIME_DTYPE = np.dtype([('frame', '<u8'), ('time', '<f8')])
+
+INDEX_EXT = ".idx"
+TIME_EXT = ".tidx"
+
+class IndexWriter:
+    """
+    Builds the index of a recording while it is being written
+
+    write() must be given every byte that is appended to the recording in order. A SYNC frame is
+    indexed once the SYNC frame after it is seen exactly PACKET_LENGTH bytes later, so the last
+    frame of a recording is never indexed.
+    When the index of an existing recording has to be built again it is done on a thread, so a gui is not
+    blocked. The bytes given to write() meanwhile are kept and indexed once the recording is scanned.
+    """
+    def __init__(self, recording_name, marker_period=1.0, index_existing=True):
+        self.recording_name = recording_name
+        self.marker_period = marker_period
+
+        self.offset = 0 # Offset in the recording of the start of tail
+        self.tail = np.zeros(0, dtype=np.uint8)
+        self.frames = 0
+        self.next_marker = 0
+
+        self.lock = threading.Lock()
+        self.pending = None # (data, timestamp) written while the index is built, None once it is built
+        self.closed = False
+        self.thread = None
+
+        # Recordings are appended to, so continue the index or build it for the bytes already there
+        recording_size = os.path.getsize(recording_name) if os.path.exists(recording_name) else 0
+        if index_existing and recording_size > 0 and index_fits(recording_name, recording_size):
+            self.frames = os.path.getsize(recording_name+INDEX_EXT)//FRAME_DTYPE.itemsize
+            # The frames in the last bytes were held back in the tail of the last session, so read them again
+            keep = min(recording_size, PACKET_LENGTH + len(SYNC) - 1)
+            self.offset = recording_size - keep
+            self.tail = np.fromfile(recording_name, dtype=np.uint8, offset=self.offset)
+            self.index_file = open(recording_name+INDEX_EXT, "ab")
+            self.time_file = open(recording_name+TIME_EXT, "ab")
+        else:
+            self.index_file = open(recording_name+INDEX_EXT, "wb")
+            self.time_file = open(recording_name+TIME_EXT, "wb")
+            if index_existing and recording_size > 0:
+                self.pending = []
+                self.thread = threading.Thread(target=self.index_recording, args=(recording_size,), daemon=True)
+                self.thread.start()
+
+    def index_recording(self, recording_size):
+        """
+        Index the first recording_size bytes of the recording, then the bytes written meanwhile
+        """
+        recording = np.memmap(self.recording_name, dtype=np.uint8, mode='r')
+        for start in range(0, recording_size, PACKET_LENGTH*50000):
+            self.index(recording[start:min(start+PACKET_LENGTH*50000, recording_size)], None)
+        del recording
+        with self.lock:
+            for data, timestamp in self.pending:
+                self.index(data, timestamp)
+            self.pending = None
+            if self.closed:
+                self.close_files()
+
+    def write(self, data, timestamp=0.0):
+        """
+        Index bytes that were just appended to the recording
+
+        timestamp is the time the bytes were received, the current time is used when it is 0
+        and no time marker is added when it is None
+        """
+        if timestamp == 0.0:
+            timestamp = time.time()
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append((np.array(data, dtype=np.uint8), timestamp))
+                return
+            self.index(data, timestamp)
+
+    def index(self, data, timestamp):
+        buf = np.concatenate([self.tail, np.asarray(data, dtype=np.uint8)])
+        inds = find_SYNC(buf)
+
+        # Only SYNC frames where the next SYNC frame can be checked are decided
+        inds = inds[inds + PACKET_LENGTH + len(SYNC) <= len(buf)]
+        verified = np.ones(len(inds), dtype=bool)
+        for i, byte in enumerate(SYNC):
+            verified &= buf[inds + PACKET_LENGTH + i] == byte
+        inds = inds[verified]
+
+        if timestamp is not None:
+            if timestamp >= self.next_marker:
+                np.array([(self.frames, timestamp)], dtype=TIME_DTYPE).tofile(self.time_file)
+                self.next_marker = timestamp + self.marker_period
+
+        records = np.zeros(len(inds), dtype=FRAME_DTYPE)
+        records['offset'] = self.offset + inds
+        records['sfid'] = buf[inds + SFID_BYTE]
+        records['frame_id'] = buf[inds + FRAME_BYTE]
+        records.tofile(self.index_file)
+        self.frames += len(inds)
+
+        # Keep every byte where an undecided SYNC frame could start
+        keep = min(len(buf), PACKET_LENGTH + len(SYNC) - 1)
+        self.offset += len(buf) - keep
+        self.tail = buf[len(buf)-keep:].copy()
+
+    def wait(self):
+        """
+        Wait until the index of the existing recording is built
+        """
+        if self.thread is not None:
+            self.thread.join()
+
+    def flush(self):
+        with self.lock:
+            if not self.closed:
+                self.index_file.flush()
+                self.time_file.flush()
+
+    def close(self):
+        """
+        Close the index files, or have the thread close them once the index is built
+        """
+        with self.lock:
+            self.closed = True
+            if self.pending is None:
+                self.close_files()
+
+    def close_files(self):
+        self.index_file.close()
+        self.time_file.close()
+
+def index_fits(recording_name, recording_size):
+    """
+    Whether the index of a recording exists and its last frame is a SYNC frame that was checked in the recording
+    """
+    if not os.path.exists(recording_name+INDEX_EXT):
+        return False
+    index_size = os.path.getsize(recording_name+INDEX_EXT)
+    if index_size % FRAME_DTYPE.itemsize != 0:
+        return False
+    if index_size == 0:
+        return True
+    last = int(np.fromfile(recording_name+INDEX_EXT, dtype=FRAME_DTYPE, offset=index_size-FRAME_DTYPE.itemsize)['offset'][0])
+    if last + PACKET_LENGTH + len(SYNC) > recording_size:
+        return False
+    frame = np.fromfile(recording_name, dtype=np.uint8, count=len(SYNC), offset=last)
+    return bool(np.all(frame == SYNC))
+
+def build_index(recording_name, bytes_ps=PACKET_LENGTH*5000, start_time=0.0):
+    """
+    Scan a recording once and write its index
+
+    Recordings do not store when bytes were received, so the time markers are estimated from bytes_ps
+    starting at start_time
+    """
+    writer = IndexWriter(recording_name, index_existing=False)
+
+    recording = np.memmap(recording_name, dtype=np.uint8, mode='r')
+    chunk_size = max(bytes_ps, PACKET_LENGTH)
+    for start in range(0, len(recording), chunk_size):
+        writer.write(recording[start:start+chunk_size], timestamp=start_time+start/bytes_ps)
+    writer.close()
+    del recording
+    return FrameIndex(recording_name)
+
+class FrameIndex:
+    """
+    Index of a recording loaded from its sidecar files
+    Frames are found from a frame number, byte offset or time with binary searches
+    """
+    def __init__(self, recording_name):
+        self.recording_name = recording_name
+        self.frames = np.fromfile(recording_name+INDEX_EXT, dtype=FRAME_DTYPE)
+        if os.path.exists(recording_name+TIME_EXT):
+            self.markers = np.fromfile(recording_name+TIME_EXT, dtype=TIME_DTYPE)
+        else:
+            self.markers = np.zeros(0, dtype=TIME_DTYPE)
+
+    def __len__(self):
+        return len(self.frames)
+
+    @staticmethod
+    def exists(recording_name):
+        return os.path.exists(recording_name+INDEX_EXT)
+
+    def offset(self, frame):
+        """
+        Byte offset of a frame number
+        """
+        return int(self.frames['offset'][frame])
+
+    def frame_at(self, offset):
+        """
+        Number of the first frame at or after a byte offset
+        """
+        return int(np.searchsorted(self.frames['offset'], offset))
+
+    def frame_at_time(self, t):
+        """
+        Number of the first frame of the last time marker at or before t
+        """
+        if len(self.markers) == 0:
+            return 0
+        marker = max(int(np.searchsorted(self.markers['time'], t, side='right'))-1, 0)
+        return int(self.markers['frame'][marker])
+
+    def offset_at_time(self, t):
+        """
+        Byte offset to start reading from to get the data at time t
+        """
+        frame = self.frame_at_time(t)
+        if frame >= len(self.frames):
+            return int(self.frames['offset'][-1]) if len(self.frames) else 0
+        return self.offset(frame)
@@ -0,0 +1,99 @@
+"""
+Module to extract minor frames from the byte stream
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from sync import SYNC
+
+MINFRAME_LEN = 2 * 40
+PACKET_LENGTH = MINFRAME_LEN + 44
+# Types of frames
+PROTOCOLS = ['all', 'odd frame', 'even frame', 'odd sfid', 'even sfid']
+
+def extract_minframes(data, inds, length=MINFRAME_LEN, stride=PACKET_LENGTH):
+    '''
+    Returns a (frames, length) uint8 matrix of the frames starting at inds with every 4 bytes reversed
+
+    When the frames are evenly spaced they are read through a strided view of data, otherwise they are gathered.
+    The endianness is swapped by viewing the frames as uint32 and byteswapping, which is the only copy made.
+    '''
+    data = np.asarray(data, dtype=np.uint8)
+    if len(inds) == 0:
+        return np.zeros((0, length), dtype=np.uint8)
+
+    if len(inds) == 1 or np.all(np.diff(inds) == stride):
+        frames = as_strided(data[inds[0]:], shape=(len(inds), length), strides=(stride*data.strides[0], data.strides[0]), writeable=False)
+        return frames.view(np.uint32).byteswap().view(np.uint8)
+
+    frames = data[np.asarray(inds)[:, None] + np.arange(length)]
+    frames.view(np.uint32).byteswap(inplace=True)
+    return frames
+
+def next_cut(inds):
+    '''
+    Start of the frames in a batch that are left for the next cycle
+
+    A frame is only kept when the next checked frame has a different counter, so the last checked frame
+    waits for the next cycle. If the stream broke after it, it is given up and the last SYNC frame is kept instead.
+    '''
+    verified = inds[:-1][(np.diff(inds) == PACKET_LENGTH)]
+    if len(verified) > 0 and verified[-1]+PACKET_LENGTH == inds[-1]:
+        return verified[-1]
+    return inds[-1]
+
+def frame_counts(data_arr, inds, limit):
+    '''
+    Frame counters of the frames before limit that have the right length and the number of SYNC frames before limit that do not
+    These are the frames that are checked for duplicate counters, so the counters include the duplicates
+    A last SYNC frame that can not be checked because data_arr ends is not malformed
+    '''
+    verified = inds[:-1][(np.diff(inds) == PACKET_LENGTH)]
+    checked = verified[:-1][verified[:-1] < limit]
+    unchecked = inds[:-1] if len(inds) > 0 and inds[-1]+PACKET_LENGTH+len(SYNC) > len(data_arr) else inds
+    return data_arr[checked + 6], np.count_nonzero(unchecked < limit) - np.count_nonzero(verified < limit)
+
+class MinorFrames:
+    '''
+    Minor frames of a batch and the rows that belong to each protocol
+
+    The frames of a protocol are only copied out of the full matrix when get() is called,
+    take() gathers just the requested columns of a protocol's rows.
+    '''
+    def __init__(self, data, inds):
+        self.frames = extract_minframes(data, inds)
+        self.rows = [None,                                    # all
+                     np.flatnonzero(self.frames[:, 57] & 3 == 1), # odd frame
+                     np.flatnonzero(self.frames[:, 57] & 3 == 2), # even frame
+                     np.flatnonzero(self.frames[:, 5] % 2 == 1),  # odd sfid
+                     np.flatnonzero(self.frames[:, 5] % 2 == 0)]  # even sfid
+        self._protocol_frames = [self.frames, None, None, None, None]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def count(self, frame_ind):
+        '''
+        Number of frames in a protocol
+        '''
+        if self.rows[frame_ind] is None:
+            return len(self.frames)
+        return len(self.rows[frame_ind])
+
+    def get(self, frame_ind):
+        '''
+        The frames of a protocol as a matrix
+        '''
+        if self._protocol_frames[frame_ind] is None:
+            self._protocol_frames[frame_ind] = self.frames[self.rows[frame_ind]]
+        return self._protocol_frames[frame_ind]
+
+    def take(self, frame_ind, cols):
+        '''
+        The columns cols of the frames of a protocol
+        '''
+        if self.rows[frame_ind] is None:
+            return self.frames[:, cols]
+        return self.frames[np.ix_(self.rows[frame_ind], cols)]
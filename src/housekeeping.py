@@ -0,0 +1,147 @@
+"""
+Module to find the packets of every housekeeping board of a protocol at once
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import numpy as np
+
+HK_LENGTH = 11 # Board id and 10 values
+HK_VALUES = HK_LENGTH-1
+
+class HousekeepingEngine:
+    """
+    Tables of the columns, masks and board ids of a list of housekeeping boards
+
+    Built once after the format file is loaded. Boards that are sent in the same columns with the same masks
+    share one byte stream, which is gathered from the minor frames once per batch by streams(). unpack() finds
+    the packets of every board in every stream in one pass and returns the values of each board.
+    8 bit boards send a byte per column and their packets are HK_LENGTH bytes. 4 bit boards send a nibble
+    per column, so their id and values are split into two nibbles and their packets are 2*HK_LENGTH long.
+    A packet is only complete once the id of the next packet of its board is found exactly one packet later.
+    decode() keeps the end of every stream that could still start a packet and puts it in front of the next
+    batch, so every packet is found exactly once wherever the batches are cut.
+    The boards must have board_id, b_ind and b_mask.
+    """
+    def __init__(self, boards):
+        self.boards = list(boards)
+
+        self.groups = [] # (columns, masks) of each stream
+        board_groups = []
+        for board in self.boards:
+            group = (tuple(board.b_ind), tuple(board.b_mask))
+            if group not in self.groups:
+                self.groups.append(group)
+            board_groups.append(self.groups.index(group))
+
+        cols, masks, self.starts = [], [], [0]
+        for group_cols, group_masks in self.groups:
+            cols += group_cols
+            masks += group_masks
+            self.starts.append(len(cols))
+        self.cols = np.array(cols, dtype=np.intp)
+        self.masks = np.array(masks, dtype=np.uint8)
+
+        # Streams of 4 bit boards are searched for the id split into two nibbles
+        self.four_bit = []
+        for group_cols, group_masks in self.groups:
+            rate = group_masks[0].bit_count()
+            if rate not in (8, 4):
+                raise ValueError("Unsupported housekeeping rate")
+            self.four_bit.append(rate == 4)
+
+        # Boards of each stream and the position in that list of every id, -1 when no board has the id.
+        # Keys of 4 bit streams above 255 are not ids, they all look up the extra last entry
+        self.group_boards = [[] for group in self.groups]
+        self.tables = [np.full(257, -1, dtype=np.int16) for group in self.groups]
+        for i, (board, group) in enumerate(zip(self.boards, board_groups)):
+            if self.tables[group][board.board_id] >= 0:
+                raise ValueError(f"Housekeeping boards in the same columns share the id {board.board_id}")
+            self.tables[group][board.board_id] = len(self.group_boards[group])
+            self.group_boards[group].append(i)
+
+        # A packet that starts in the last packet length (and nibble) of a stream cannot be complete yet
+        self.tail_lengths = [2*HK_LENGTH+1 if four_bit else HK_LENGTH for four_bit in self.four_bit]
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the end of the streams kept from the last batch
+        """
+        self.tails = [np.zeros(0, dtype=np.uint8) for group in self.groups]
+
+    def __len__(self):
+        return len(self.boards)
+
+    def streams(self, minframes, rows=None):
+        """
+        The byte stream of every group of columns, frame by frame and then column by column
+        rows selects the frames of the protocol from minframes, all frames are used when it is None
+        """
+        if len(self.cols) == 0:
+            return []
+        if rows is None:
+            block = minframes[:, self.cols]
+        else:
+            block = minframes[np.ix_(rows, self.cols)]
+        block &= self.masks
+        return [block[:, start:end].ravel() for start, end in zip(self.starts[:-1], self.starts[1:])]
+
+    def unpack(self, streams):
+        """
+        Find the packets of every board in the streams, returns a (10, packets) array of counts for each board
+        """
+        board_values = [None]*len(self.boards)
+        for stream, table, boards, four_bit in zip(streams, self.tables, self.group_boards, self.four_bit):
+            units = 2 if four_bit else 1
+            length = units*HK_LENGTH
+            if len(boards) == 1:
+                # A stream of one board is only searched for its id
+                board_id = self.boards[boards[0]].board_id
+                if four_bit:
+                    found = np.flatnonzero((stream[:-1] == board_id>>4) & (stream[1:] == board_id&0xF))
+                else:
+                    found = np.flatnonzero(stream == board_id)
+                starts = found[:-1][np.diff(found) == length]
+                packet_board = None
+            else:
+                # Position in boards of the id at every position of the stream, -1 when no board's id is there
+                if four_bit:
+                    # The id of 4 bit boards is the nibble at a position and the one after it
+                    board = np.full(len(stream), -1, dtype=np.int16)
+                    if len(stream) > 0:
+                        keys = (stream[:-1].astype(np.uint16) << 4) | stream[1:]
+                        np.take(table, np.minimum(keys, 256), out=board[:-1])
+                else:
+                    board = np.take(table, stream)
+
+                # Ids of the same board in order, each one followed by the next one a packet later starts a packet
+                found = np.flatnonzero(board >= 0)
+                found = found[np.argsort(board[found], kind='stable')]
+                found_board = board[found]
+                complete = (found_board[1:] == found_board[:-1]) & (np.diff(found) == length)
+                starts, packet_board = found[:-1][complete], found_board[:-1][complete]
+
+            # Every value of every packet of the stream is gathered at once
+            inds = starts+units*np.arange(1, HK_VALUES+1)[:, None]
+            if four_bit:
+                values = (np.take(stream, inds).astype(np.uint16) << 4) | np.take(stream, inds+1)
+            else:
+                values = np.take(stream, inds)
+
+            if packet_board is None:
+                board_values[boards[0]] = values.astype(np.float64)
+                continue
+            # Packets are sorted by board, so each board's values are one slice
+            splits = np.cumsum(np.bincount(packet_board, minlength=len(boards)))[:-1]
+            for i, values in zip(boards, np.split(values, splits, axis=1)):
+                board_values[i] = values.astype(np.float64)
+        return board_values
+
+    def decode(self, minframes, rows=None):
+        """
+        Values of the packets of every board that were completed by this batch of minor frames
+        The batches have to be passed in order, the end of each stream is kept for the next call
+        """
+        streams = [np.concatenate([tail, stream]) for tail, stream in zip(self.tails, self.streams(minframes, rows))]
+        self.tails = [stream[max(len(stream)-tail_length, 0):] for stream, tail_length in zip(streams, self.tail_lengths)]
+        return self.unpack(streams)
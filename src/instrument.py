@@ -0,0 +1,102 @@
+"""
+Module to time each stage of the parsing cycle
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import json, time
+
+import numpy as np
+
+from buffers import CircularBuffer
+
+STAGES = ["receive", "sync", "frames", "gps", "channels", "housekeeping", "write", "render"]
+PERCENTILES = [50, 95, 99]
+
+class StageTimer:
+    """
+    Rolling history of how long each stage of the last window cycles took
+
+    A cycle is timed with begin(), then lap(stage) after each stage, which records the time since the
+    last lap, and end(). Stages that did not run in a cycle are recorded as 0. When a log file is opened
+    the percentiles are written to it as a JSON line every log_period seconds.
+    """
+    def __init__(self, stages=STAGES, window=1000, log_period=1.0):
+        self.stages = list(stages)
+        self.times = CircularBuffer(window, rows=len(self.stages))
+        self.cycle = np.zeros(len(self.stages))
+        self.stage_rows = {stage:i for i, stage in enumerate(self.stages)}
+        self.cycles = 0
+        self.totals = np.zeros(len(self.stages)) # Seconds spent in each stage since reset()
+        self.last_lap = 0.0
+
+        self.log_file = None
+        self.log_period = log_period
+        self.next_log = 0.0
+
+    def begin(self):
+        self.cycle.fill(0)
+        self.last_lap = time.perf_counter()
+
+    def lap(self, stage):
+        """
+        Add the time since the last lap to stage
+        """
+        now = time.perf_counter()
+        self.cycle[self.stage_rows[stage]] += now-self.last_lap
+        self.last_lap = now
+
+    def skip(self):
+        """
+        Leave the time since the last lap out of every stage
+        """
+        self.last_lap = time.perf_counter()
+
+    def end(self):
+        self.times.write(self.cycle[:, None])
+        self.totals += self.cycle
+        self.cycles += 1
+        if self.log_file is not None and time.time() >= self.next_log:
+            self.log()
+
+    def summary(self):
+        """
+        Percentiles and mean of every stage in ms over the last window cycles
+        """
+        n = min(self.cycles, len(self.times))
+        if n == 0:
+            return {stage:dict.fromkeys([f"p{p}" for p in PERCENTILES]+["mean"], 0.0) for stage in self.stages}
+        times = self.times.latest(n)*1000
+        percentiles = np.percentile(times, PERCENTILES, axis=1)
+        means = times.mean(axis=1)
+        summary = {}
+        for i, stage in enumerate(self.stages):
+            summary[stage] = {f"p{p}": float(percentiles[j, i]) for j, p in enumerate(PERCENTILES)}
+            summary[stage]["mean"] = float(means[i])
+        return summary
+
+    def open_log(self, file_name):
+        self.close_log()
+        self.log_file = open(file_name, "a")
+        self.next_log = 0.0
+
+    def log(self):
+        self.log_file.write(json.dumps({"time": time.time(), "cycles": self.cycles, "stages_ms": self.summary()})+"\n")
+        self.log_file.flush()
+        self.next_log = time.time()+self.log_period
+
+    def close_log(self):
+        if self.log_file is not None:
+            self.log()
+            self.log_file.close()
+            self.log_file = None
+
+    def total_times(self):
+        """
+        Seconds spent in every stage since reset()
+        """
+        return {stage:float(total) for stage, total in zip(self.stages, self.totals)}
+
+    def reset(self):
+        self.times.fill(0)
+        self.totals.fill(0)
+        self.cycles = 0
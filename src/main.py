@@ -4,41 +4,49 @@ Main file to run ui
 Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
 by Yash Jain
 """
-import sys, os, ctypes
+import time
+START_TIME = time.perf_counter() # Start up times are measured from here
+
+import sys, os, ctypes, threading
 from os.path import dirname, abspath, basename
 from datetime import datetime, timedelta
 
-import plotting
-
-from openpyxl import load_workbook
+from frameindex import IndexWriter
+from formatfile import load_format
+from instrument import STAGES
 
 from PyQt5 import QtCore
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import (QApplication, QGridLayout, QGroupBox, QComboBox, QHBoxLayout, QFrame, QMainWindow,
                              QPushButton, QWidget, QLabel, QLineEdit, QFileDialog, QSpinBox, QDialog)
 
-xl_sheet = None
-GRAPH_ROW_TYPE =   [str, str, int,  int,  str, str, int]
-CHANNEL_ROW_TYPE = [str, str, bool, list, list]
-MAP_ROW_TYPE =     [str, str, int,  int,  str]
-HK_ROW_TYPE =      [str, int, str,  int,  list, list, bool, bool, bool, bool, bool, bool, bool, bool, bool, bool, bool]
-def getval(cell, t):
-    '''
-    Read a cell with
-    '''
-    if xl_sheet==None:
-        return None
-    val = xl_sheet[cell].value
-    if t==int:
-        return val
-    elif t==str:
-        return val
-    elif t==bool:
-        return val
-    elif t==list:
-        return [int(i) for i in str(val).split(';')]
-    else:
-        return val
+# Same as plotting, which is not imported until it is needed
+GPS_NAMES = ["Longitude (deg)", "Latitude (deg)", "Altitude (km)", "vEast (m/s)", "vNorth (m/s)", "vUp (m/s)", "Horz. Speed (m/s)", "Num Sats"]
+GPS_NAMES_ID = ["lon", "lat", "alt", "veast", "vnorth", "vup", "shorz", "numsats"]
+
+plotting = None # Imported by load_plotting(), it brings in vispy, scipy and pymap3d
+plotting_lock = threading.Lock()
+startup_times = {} # Seconds from START_TIME to each step of starting up
+
+def mark_startup(step):
+    startup_times[step] = time.perf_counter()-START_TIME
+
+def startup_report():
+    return "\n".join(f"{step:>20} {seconds*1000:8.1f} ms" for step, seconds in startup_times.items())
+
+def load_plotting():
+    """
+    Import plotting the first time it is needed, from the main thread or the warm up thread
+    """
+    global plotting
+    with plotting_lock:
+        if plotting is None:
+            start_time = time.perf_counter()
+            import plotting as plotting_module
+            plotting = plotting_module
+            startup_times["import plotting"] = time.perf_counter()-start_time
+    return plotting
+
 
 class QSelectedGroupBox(QGroupBox):
     """
@@ -53,10 +61,80 @@ class QSelectedGroupBox(QGroupBox):
         if not child:
             self.func()
         
+class TimingPanel(QDialog):
+    """
+    Window with the percentiles of the time each stage of parsing took over the last cycles
+    """
+    def __init__(self, parent, log_func):
+        super(TimingPanel, self).__init__(parent)
+        self.setWindowTitle("Stage Times (ms)")
+        layout = QGridLayout()
+
+        columns = ["p50", "p95", "p99", "mean"]
+        for col, name in enumerate(columns):
+            layout.addWidget(QLabel(name), 0, col+1)
+
+        self.outputs = {}
+        for row, stage in enumerate(STAGES):
+            layout.addWidget(QLabel(stage), row+1, 0)
+            for col, name in enumerate(columns):
+                output = QLineEdit(text="0.00", alignment=QtCore.Qt.AlignRight)
+                output.setReadOnly(True)
+                output.setFixedWidth(60)
+                layout.addWidget(output, row+1, col+1)
+                self.outputs[stage, name] = output
+
+        self.logButton = QPushButton("Log to file")
+        self.logButton.setCheckable(True)
+        self.logButton.clicked.connect(log_func)
+        layout.addWidget(self.logButton, len(STAGES)+1, 0, 1, len(columns)+1)
+        self.setLayout(layout)
+
+    def update_times(self, summary):
+        for (stage, name), output in self.outputs.items():
+            output.setText(f"{summary[stage][name]:.2f}")
+
 class Window(QMainWindow):
     """
     Main window where start up and housekeeping values are
     """
+    def plots(self):
+        """
+        plotting module, loaded and given the state of the window the first time
+        """
+        if not self.plots_ready:
+            load_plotting()
+            plotting.close_signal = self.close_plots
+            plotting.gps_values.update(self.gps_values)
+            plotting.set_hkunits(self.do_hkunits)
+            plotting.do_write = self.do_write
+            plotting.write_file = self.write_file
+            plotting.write_index = self.write_index
+            plotting.timing_log = self.timing_log
+            self.plots_ready = True
+        return plotting
+
+    def find_instr_files(self):
+        """
+        Add the format files in lib to the instrument list
+        """
+        for file in sorted(os.listdir(self.search_dir)):
+            if file.endswith(".xlsx"):
+                self.found_instr_files.append(os.path.join(self.search_dir, file))
+        self.pickInstrCombo.addItems(map(basename, self.found_instr_files))
+        mark_startup("instrument list")
+
+    def warm_up(self):
+        """
+        Import plotting on a background thread so it is ready when a format is picked
+        """
+        def warm():
+            load_plotting()
+            mark_startup("warm up")
+            if self.show_startup_times:
+                print(startup_report())
+        threading.Thread(target=warm, daemon=True).start()
+
     def getFile(self, title, fdir, ftype):
         """
         Opens file explorer to select a file and then returns it
@@ -81,7 +159,7 @@ class Window(QMainWindow):
         self.map_file = self.getFile("Pick a map file", self.dir+"/lib", "Mat Map Files (*.mat);;All files (*)") 
         if self.map_file is not None:   
             self.pickMapNameLabel.setText(basename(self.map_file))
-            plotting.set_map(self.map_file)
+            self.plots().set_map(self.map_file)
     
     def pickInstr(self, n):
         if n==0:
@@ -97,7 +175,6 @@ class Window(QMainWindow):
             self.changeInstr(file_path)
         
     def changeInstr(self, file_path):
-        global xl_sheet
         if self.instr_file == file_path:
             return
 
@@ -113,61 +190,36 @@ class Window(QMainWindow):
         self.plotWidthSpin.setDisabled(True)
         self.plotWidthLabel.setDisabled(True) 
 
+        format_spec = load_format(file_path)
+        plotting = self.plots()
         plotting.plot_width = self.plotWidthSpin.value()
-        
-        xl_sheet = load_workbook(file_path, data_only=True).active
 
         # Bytes/second
-        bps = getval("D3", int)
-        plotting.set_max_read_length(bps)
+        plotting.set_max_read_length(format_spec["bytes_ps"])
 
         # Graphs
-        graph_rows = getval("D6", list)
-        for row_num in range(graph_rows[0],graph_rows[1]+1):
-            row = [getval(chr(i)+str(row_num),t) for i, t in zip(range(ord('C'),ord('C')+len(GRAPH_ROW_TYPE)), GRAPH_ROW_TYPE)]
+        for row in format_spec["graphs"]:
             plotting.add_graph(*row)
 
         # Channels
-        channel_rows = getval("D7", list)
-        for row_num in range(channel_rows[0],channel_rows[1]+1):
-            row = [getval(chr(i)+str(row_num),t) for i, t in zip(range(ord('C'),ord('C')+len(CHANNEL_ROW_TYPE)), CHANNEL_ROW_TYPE)]
+        for row in format_spec["channels"]:
             plotting.add_channel(*row)
 
         # Map
-        map_rows = getval("D8", list)
-        for row_num in range(map_rows[0],map_rows[1]+1):
-            row = [getval(chr(i)+str(row_num),t) for i, t in zip(range(ord('C'),ord('C')+len(MAP_ROW_TYPE)), MAP_ROW_TYPE)]
+        for row in format_spec["maps"]:
             plotting.add_map(*row)
                 
         # Housekeeping
-        hk_rows = getval("D9", list)
-        for row_num in range(hk_rows[0], hk_rows[1]+1):
-            row = [getval(chr(i)+str(row_num),t) for i, t in zip(range(ord('C'), ord('C')+len(HK_ROW_TYPE)), HK_ROW_TYPE)]
-            hkValues = self.addHousekeeping(row[0], row[8:], plotting.HK_NAMES)
-            plotting.add_housekeeping(*row)
-        
-        # Housekeeping
-        hk_row_start, hk_row_end = getval("C5"), getval("D5")
-        for row_num in range(int(hk_row_start), int(hk_row_end)+1):
-            row = [getval("B"+str(row_num))]
-            i = 1
-            while row[-1] != "None":
-                row.append( getval(chr(ord("B")+i) + str(row_num)) )
-                i += 1
-
-            # Remove last cell which is "None"
-            row = row[:-1]
-
-            if len(row) == 0:
-                continue
+        # [title, numpoints, frame type, board id, index, bitmask, one flag for each value and Dig ACC]
+        plotting.set_acc_dig_temp(None)
+        for row in format_spec["housekeeping"]:
+            if row[0] == "ACC":
+                # The digital accelerometer temperature is not in the ACC packets, plotting decodes it from the frames
+                hkValues = self.addHousekeeping(row[0], row[6:], plotting.HK_NAMES[:-1]+["Dig Temp"])
+                plotting.set_acc_dig_temp(hkValues[-1])
             else:
-                if (row[0]=="ACC"):
-                    hkValues = self.addHousekeeping(row[0], row[7:]+["True"], plotting.HK_NAMES+["Dig Temp"], )
-                    plotting.set_acc_dig_temp(hkValues[-1])
-                    plotting.add_housekeeping(*row[1:7], hkValues[:-1])
-                else:
-                    hkValues = self.addHousekeeping(row[0], row[7:], plotting.HK_NAMES)
-                    plotting.add_housekeeping(*row[1:7], hkValues)
+                hkValues = self.addHousekeeping(row[0], row[6:], plotting.HK_NAMES[:-1])
+            plotting.add_housekeeping(*row[:6], hkValues[:len(plotting.HK_NAMES)-1])
         
         self.valuesWidget.show()
         plotting.finish_creating()
@@ -189,7 +241,7 @@ class Window(QMainWindow):
             hkValue.setFixedWidth(65)
             hkValue.setReadOnly(True)
 
-            if ttable[ind] == "False":
+            if ttable[ind] in (False, "False"):
                 hkLabel.setEnabled(False)
                 hkValue.setEnabled(False)
     
@@ -225,14 +277,20 @@ class Window(QMainWindow):
             self.writeFileNameEdit.setEnabled(True)
             self.write_file.close()
             self.write_file = None
+            self.write_index.close()
+            self.write_index = None
         else:
             self.writeStart.setStyleSheet("background-color: #29d97e")
             self.do_write=True
             self.writeFileNameEdit.setEnabled(False)
-            self.write_file = open(self.dir+"/recordings/"+self.writeFileNameEdit.text()+".udp", "ab")
+            write_file_name = self.dir+"/recordings/"+self.writeFileNameEdit.text()+".udp"
+            self.write_index = IndexWriter(write_file_name)
+            self.write_file = open(write_file_name, "ab")
          
-        plotting.do_write = self.do_write
-        plotting.write_file = self.write_file
+        if self.plots_ready:
+            plotting.do_write = self.do_write
+            plotting.write_file = self.write_file
+            plotting.write_index = self.write_index
     
     def time_run(self):
         self.read_time+=1
@@ -240,6 +298,38 @@ class Window(QMainWindow):
         if self.do_write:
             self.write_time+=1
             self.writeTimeOutput.setText(str(timedelta(seconds=self.write_time)))
+        self.update_frame_stats()
+        if self.timingPanel.isVisible() and self.plots_ready:
+            self.timingPanel.update_times(plotting.timer.summary())
+
+    def toggle_timing_panel(self):
+        self.timingPanel.setVisible(self.timingShow.isChecked())
+        if self.plots_ready:
+            self.timingPanel.update_times(plotting.timer.summary())
+
+    def toggle_timing_log(self):
+        # Stage times are added to a JSON lines file next to the recordings
+        if self.timingPanel.logButton.isChecked():
+            self.timing_log = self.dir+"/recordings/"+self.writeFileNameEdit.text()+".timing.jsonl"
+        else:
+            self.timing_log = None
+        if not self.plots_ready:
+            return
+        plotting.timing_log = self.timing_log
+        if self.timing_log is None:
+            plotting.timer.close_log()
+        elif self.readStart.isChecked():
+            plotting.timer.open_log(self.timing_log)
+
+    def update_frame_stats(self):
+        if not self.plots_ready:
+            return
+        stats = plotting.stats()
+        frames = stats["frames"]["total"]
+        text = f"{frames['dropped']} lost, {frames['duplicate']} dup, {frames['out_of_order']} late, {frames['malformed']} bad"
+        if stats["receiver"] is not None:
+            text += f", {stats['receiver']['dropped_datagrams']} rx"
+        self.frameStatsOutput.setText(text)
             
     def time_read_reset(self):
         self.read_time = 0
@@ -251,7 +341,8 @@ class Window(QMainWindow):
     
     def toggle_hk(self):
         self.do_hkunits = not self.do_hkunits
-        plotting.set_hkunits(self.do_hkunits)
+        if self.plots_ready:
+            plotting.set_hkunits(self.do_hkunits)
 
         if self.do_hkunits:
             self.hkCountUnit.setText("Units")
@@ -277,15 +368,16 @@ class Window(QMainWindow):
             self.time_write_reset()
             self.timer.start(1000)
             
-            plotting.parse(self.read_mode, self.plotHertzSpin.value(), self.read_file, self.hostInputLine.text(), int(self.portInputLine.text()))
+            self.plots().parse(self.read_mode, self.plotHertzSpin.value(), self.read_file, self.hostInputLine.text(), int(self.portInputLine.text()))
             
             self.timer.stop()
+            self.update_frame_stats()
             self.readStart.setText("Start")
             self.readStart.setStyleSheet("background-color: #e34040")
             self.setupGroupBox.setEnabled(True)
 
             self.readStart.setChecked(False)
-        else:
+        elif self.plots_ready:
             plotting.running = False
             plotting.wait = False
     def close_plots(self):
@@ -312,9 +404,10 @@ class Window(QMainWindow):
 
     # QMainWindow.closeEvent
     def closeEvent(self, close_msg):
-        plotting.on_close(None)
+        if self.plots_ready:
+            plotting.on_close(None)
     
-    def __init__(self):
+    def __init__(self, show_startup_times=False):
         QMainWindow.__init__(self)
         self.setWindowIcon(QIcon('icon.png'))
         self.setWindowTitle("VortEx Parser")
@@ -330,25 +423,25 @@ class Window(QMainWindow):
 
         self.do_write = False
         self.write_file = None
+        self.write_index = None
         self.write_time = 0
 
         self.map_file = None
 
         self.instr_file = None
-        self.search_dir = self.dir + "\\lib\\"
-        self.found_instr_files = []
+        self.search_dir = os.path.join(self.dir, "lib")
+        self.found_instr_files = [] # Found by find_instr_files() once the window is shown
 
         self.do_hkunits = True
+        self.timing_log = None
 
         self.plot_windows = {}
         self.hkBoxes = []
 
-        plotting.close_signal = self.close_plots
-
-        for file in os.listdir(self.search_dir):
-             if file.endswith(".xlsx"):
-                self.found_instr_files.append(self.search_dir + file)
-        self.instr_file = None
+        # plotting is loaded by plots() when it is first needed
+        self.plots_ready = False
+        self.gps_values = {}
+        self.show_startup_times = show_startup_times
 
         # Top ------------------------------
         self.setupGroupBox = QGroupBox("Setup")
@@ -362,7 +455,6 @@ class Window(QMainWindow):
         self.pickInstrNameEdit.setReadOnly(True)
         self.pickInstrCombo = QComboBox()
         self.pickInstrCombo.addItem("-- select file --")
-        self.pickInstrCombo.addItems(map(basename, self.found_instr_files))
         self.pickInstrCombo.setCurrentIndex(0)
         self.pickInstrCombo.currentIndexChanged.connect(self.pickInstr)
         self.pickInstrCombo.setLineEdit(self.pickInstrNameEdit)
@@ -479,6 +571,13 @@ class Window(QMainWindow):
         self.hkCountUnit.setStyleSheet("background-color: #9e9e9e")
         self.hkCountUnit.released.connect(self.toggle_hk)
 
+        self.timingLabel = QLabel("Stage times ")
+        self.timingShow = QPushButton("Show")
+        self.timingShow.setFixedWidth(40)
+        self.timingShow.setCheckable(True)
+        self.timingShow.clicked.connect(self.toggle_timing_panel)
+        self.timingPanel = TimingPanel(self, self.toggle_timing_log)
+
         self.leftBox = QGridLayout()
         self.leftBox.setRowStretch(0, 1)
         self.leftBox.addWidget(self.readStartLabel, 0, 0)
@@ -487,6 +586,8 @@ class Window(QMainWindow):
         self.leftBox.addWidget(self.writeStart, 1, 1)
         self.leftBox.addWidget(self.hklabel, 2, 0)
         self.leftBox.addWidget(self.hkCountUnit, 2, 1)
+        self.leftBox.addWidget(self.timingLabel, 3, 0)
+        self.leftBox.addWidget(self.timingShow, 3, 1)
 
 
         # Right Box
@@ -511,6 +612,12 @@ class Window(QMainWindow):
         self.writeTimeOutput.setFixedWidth(100)
 
         self.writeFileNameLabel = QLabel("Write File Name")
+
+        self.frameStatsLabel = QLabel("Frames")
+        self.frameStatsOutput = QLineEdit(alignment=QtCore.Qt.AlignRight)
+        self.frameStatsOutput.setReadOnly(True)
+        self.frameStatsOutput.setToolTip("Frames skipped by the frame counter, duplicated, behind the counter and without a SYNC frame after them,\n"
+                                         "and datagrams dropped because parsing was behind")
         
         self.writeFileNameEdit = QLineEdit("Recording"+datetime.today().strftime('%Y-%m-%d'))
         self.writeFileNameEdit.setFixedWidth(122)
@@ -526,6 +633,8 @@ class Window(QMainWindow):
         self.rightBox.addWidget(self.writeTimeOutput, 1, 2, 1, 2)
         self.rightBox.addWidget(self.writeFileNameLabel, 2, 0)
         self.rightBox.addWidget(self.writeFileNameEdit, 2, 1, 1, 3)
+        self.rightBox.addWidget(self.frameStatsLabel, 3, 0)
+        self.rightBox.addWidget(self.frameStatsOutput, 3, 1, 1, 3)
 
         # Live control box
         self.liveControlBox = QGridLayout()
@@ -542,10 +651,8 @@ class Window(QMainWindow):
         # Gps values
         self.gpsGroupBox = QGroupBox("GPS")
         self.gpsLayout = QGridLayout()
-        plotting.gpsValues = [] # list of all edits
-        
         # Add a label and edit for each gps value
-        for ind, (name, name_short) in enumerate(zip(plotting.GPS_NAMES, plotting.GPS_NAMES_ID)):
+        for ind, (name, name_short) in enumerate(zip(GPS_NAMES, GPS_NAMES_ID)):
             gpsLabel = QLabel(name)
             gpsValue = QLineEdit()
 
@@ -555,7 +662,7 @@ class Window(QMainWindow):
             self.gpsLayout.addWidget(gpsLabel, ind, 0)
             self.gpsLayout.addWidget(gpsValue, ind, 1)
             
-            plotting.gps_values[name_short] = gpsValue
+            self.gps_values[name_short] = gpsValue
         
         self.gpsGroupBox.setLayout(self.gpsLayout)
 
@@ -576,9 +683,28 @@ class Window(QMainWindow):
         self.central_widget.setLayout(self.mainGrid)
 
 
+def on_shown(win, warm):
+    # Runs once the event loop has drawn the window
+    mark_startup("window shown")
+    win.find_instr_files()
+    if win.show_startup_times:
+        print(startup_report())
+    if warm:
+        win.warm_up()
+
 if __name__ == '__main__':
-    ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(u'sailparser')
-    app = QApplication(sys.argv)
-    win = Window()
+    import argparse
+    arg_parser = argparse.ArgumentParser(description="VortEx Parser")
+    arg_parser.add_argument("--no-warm-up", action="store_true", help="Only import plotting when a format is picked or parsing starts")
+    arg_parser.add_argument("--startup-times", action="store_true", help="Print how long each step of starting up took")
+    args, qt_args = arg_parser.parse_known_args()
+    mark_startup("imports")
+
+    if sys.platform == "win32":
+        ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(u'sailparser')
+    app = QApplication(sys.argv[:1]+qt_args)
+    win = Window(args.startup_times)
+    mark_startup("window created")
     win.show()
+    QtCore.QTimer.singleShot(0, lambda: on_shown(win, not args.no_warm_up))
     sys.exit(app.exec_())
\ No newline at end of file
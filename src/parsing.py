@@ -4,16 +4,28 @@ Module to handle incoming data
 Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
 by Yash Jain
 """
-from os.path import dirname, abspath
+import os
+from os.path import dirname, abspath, basename, splitext
 
 import time                           
+from concurrent.futures import ProcessPoolExecutor # Decoding recordings on every core
 from datetime import datetime
 
 import numpy as np                                # Vectorization with numpy arrays
 from math import log2                             # Parsing byte data          
-from openpyxl import load_workbook                # Reading excel format files
-from pymap3d.ecef import ecef2geodetic, ecef2enuv # For coordinates
-import socket                                     # Recieving data with socket
+
+from gps import decode_gps, GPSDecoder, GPS_DTYPE # Decoding the RV packets of the gps
+from sync import find_SYNC, SyncLock               # Searching for SYNC frames
+from buffers import ByteRing, CircularBuffer      # Buffers that data is read into and stored in
+from frames import MinorFrames, next_cut, frame_counts # Minor frames of each protocol
+from recording import RecordingReader             # Memory mapped recordings
+from decodeplan import DecodePlan                 # Decoding all channels at once
+from housekeeping import HousekeepingEngine       # Finding the packets of every board at once
+from frameindex import IndexWriter                # Index of the recording being written
+from continuity import ContinuityTracker           # Dropped and duplicate frame counts
+from instrument import StageTimer, STAGES                # Time of each stage of parsing
+from receiver import UDPReceiver, create_async_receiver, MAX_DATAGRAM # Recieving data on its own thread or an event loop
+from formatfile import load_format                # Compiled and cached excel format files
 
 # SYNC frames to identify minor frames
 # All minor frames end in SYNC
@@ -25,6 +37,8 @@ bytes_ps = PACKET_LENGTH * 5000 # bytes_ps will be manually set in the excel for
 PROTOCOLS = ['all', 'odd frame', 'even frame', 'odd sfid', 'even sfid']
 
 data_channels = {} # Sort channels and hk by protocol
+decode_plans = {}  # Channel names and DecodePlan of each protocol
+hk_engines = {}    # Housekeeping names and HousekeepingEngine of each protocol
 all_data = {}
 
 MAX_NUMPOINTS = 50000
@@ -35,27 +49,26 @@ GPS_NAMES = ["Longitude (deg)", "Latitude (deg)", "Altitude (km)", "vEast (m/s)"
 # Identify gps data in RV frames
 RV_HEADER = [114, 86, 48, 50, 65]
 RV_LEN = 48
-gps_data = None
+gps_track = None # CircularBuffer of GPS_DTYPE records
+gps_data = None  # Views of the fields of gps_track by name
 
 # Housekeeping coefficients and constants for converting from counts to units
 hkunits = True # When true counts will be converted to units
-HK_LENGTH = 11
 HK_NAMES =          ["Temp1" , "Temp2" , "Temp3" , "Int. Temp", "V Bat", "-12 V", "+12 V", "+5 V", "+3.3 V", "VBat Mon"]
 HK_COEF  = np.array([-76.9231, -76.9231, -76.9231, -76.9231   , 16     , 6.15   , 7.329  , 3     ,  2      , 2         ], dtype=np.float64)[:, None]
 HK_ADD   = np.array([202.54  , 202.54  , 202.54  , 202.54     , 0      , -16.88 , 0      , 0     ,  0      , 0         ], dtype=np.float64)[:, None]
 # Housekeeping display constants
 DEC_PLACES = 3     # Decimals of precision for housekeeping 
 AVG_NUMPOINTS = 10 # Number of housekeeping points to average
-# ACC's dig temp is a hardcoded housekeeping value
-acc_dig_temp = None
-acc_dig_temp_data = np.zeros(25000, np.uint32)
 
 # When read mode is 0 then a read_file is the read
 # When read mode is 1 then the socket is used
 read_mode = 0
 
 # Socket variables
-sock = None
+receiver = None # UDPReceiver in read_mode 1
+async_receiver = None # AsyncUDPReceiver in read_mode 3
+udp_address = ("127.0.0.1", 5000) # Address bound by start_async() in read_mode 3
 sock_timeout = 5.0 # How long to wait for data before ending. 
 sock_wait = 0.1
 sock_rep = int(sock_timeout/sock_wait)
@@ -65,61 +78,20 @@ read_file = None
 # Write file
 write_mode = False
 write_file = None
-raw_data = None
-last_ind_arr = np.empty(0)
+write_index = None # IndexWriter of write_file
+ring = None # Bytes that have been read but not parsed yet
+sync_lock = SyncLock(PACKET_LENGTH)
+continuity = ContinuityTracker()
+gps_decoder = GPSDecoder() # Keeps the end of the gps stream between cycles
+timer = StageTimer(STAGES[:-1]) # Nothing is rendered
 
 # Plot rate settings
 plot_hertz = 5
 plot_width = 5
 
 # Excel Sheet
-xl_sheet = None
-# The type of values in the excel sheet
-GRAPH_ROW_TYPE =   [str, str, int,  int,  str, str, int]
-CHANNEL_ROW_TYPE = [str, str, bool, list, list]
-MAP_ROW_TYPE =     [str, str, int,  int,  str]
-HK_ROW_TYPE =      [str, int, str,  int,  list, list, bool, bool, bool, bool, bool, bool, bool, bool, bool, bool, bool]
-
-def getval(cell, t):
-    '''
-    Read a cell with
-    '''
-    if xl_sheet==None:
-        return None
-    val = xl_sheet[cell].value
-    print(val)
-    if t==int:
-        return val
-    elif t==str:
-        return val
-    elif t==bool:
-        return val
-    elif t==list:
-        return [int(i) for i in str(val).split(';')]
-    else:
-        return val
-        
+format_file_name = "" # Loaded again by the processes of recording_executor()
 
-# Swap endianness: [3, 2, 1, 0, 7, 6, 5, 4 ... 79, 78, 77, 76]
-e = np.arange(MINFRAME_LEN)
-for i in range(0, MINFRAME_LEN, 4):
-    e[i:i+4] = e[i:i+4][::-1]
-
-sync_arr = np.array(SYNC)
-target_sync = np.dot(sync_arr, sync_arr)
-def find_SYNC(seq):
-    candidates = np.where(np.correlate(seq, sync_arr, mode='valid') == target_sync)[0]
-    check = candidates[:, np.newaxis] + np.arange(4)
-    mask = np.all((np.take(seq, check) == sync_arr), axis=-1)
-    return candidates[mask] 
-
-rv_arr = np.array(RV_HEADER)
-target_rv = np.dot(rv_arr, rv_arr)
-def find_RV(seq):
-    candidates = np.where(np.correlate(seq, rv_arr, mode='valid') == target_rv)[0]
-    check = candidates[:, np.newaxis] + np.arange(5)
-    mask = np.all((np.take(seq, check) == rv_arr), axis=-1)
-    return candidates[mask]
 
 def add_channel(graph_name, protocol, signed, byte_ind, bitmask):
     # Graph must fit the channel data
@@ -130,126 +102,110 @@ def add_housekeeping(name, numpoints, protocol, board_id, byte_ind, bitmask, *hk
     data_channels["hk_"+name] = Housekeeping(protocol, board_id, numpoints, byte_ind, bitmask)
     all_data["hk_"+name] = None
 
+def compile_decode_plans():
+    '''
+    Build the byte tables of every protocol once all channels and housekeeping boards have been added
+    '''
+    decode_plans.clear()
+    hk_engines.clear()
+    for frame_ind in range(len(PROTOCOLS)):
+        names = [name for name, dch in data_channels.items() if isinstance(dch, Channel) and dch.frame_ind==frame_ind]
+        if len(names) > 0:
+            decode_plans[frame_ind] = (names, DecodePlan([data_channels[name] for name in names]))
+        names = [name for name, dch in data_channels.items() if isinstance(dch, Housekeeping) and dch.frame_ind==frame_ind]
+        if len(names) > 0:
+            hk_engines[frame_ind] = (names, HousekeepingEngine([data_channels[name] for name in names]))
 
 
-def crc_16(arr):
-    """
-    Checksum for gps data
-    """
-    crc = 0
-    for i in arr:
-        crc ^= (i<<8)
-        for i in range(0,8):
-            if (crc&0x8000)>0:
-                crc <<= 1
-                crc ^= 0x1021
-            else:
-                crc <<= 1
-        crc &= (1<<16)-1
-    return crc
     
-def init(format_file, read_mode=1, udp_ip="127.0.0.1", udp_port="5000", read_file_name="", do_write=0, write_file_name="", do_hkunits=1, hertz=5, width=5) -> None:
+def init(format_file, mode=1, udp_ip="127.0.0.1", udp_port="5000", read_file_name="", do_write=0, write_file_name="", do_hkunits=1, hertz=5, width=5, timing_log="") -> None:
     '''
     Setup for parsing by specifying how the data
 
     format_file               The path as a string to a valid excel format file
-    read_mode  =1             Set to 1 for parsing udp data and 0 for read from read_file
-    udp_ip     ="127.0.0.1"   The socket ip address [read_mode=1]
-    udp_port   ="5000"        The socket port [read_mode=1]
-    read_file  =""            The path as a string to a recording file [read_mode=0]
+    mode       =1             Set to 1 for parsing udp data, 0 for read from read_file, 2 to parse whole recordings with parse_recording()
+                              and 3 for parsing udp data on an asyncio event loop with start_async()
+    udp_ip     ="127.0.0.1"   The socket ip address [mode=1, 3]
+    udp_port   ="5000"        The socket port [mode=1, 3]
+    read_file  =""            The path as a string to a recording file [mode=0]
     write_mode =0             Set to 1 to write to write_file
     write_file =""            The name as a string for the file to write to. Will default to a name with todays date.
     hk_units   =1             Set to 1 to have housekeeping data in units, 0 for counts
     hertz      =5             parse() will read (1/plot_hertz) seconds of data
     width      =5             The amount of seconds of data to store 
+    timing_log =""            File to add the stage times of parse() to as JSON lines every second
     '''
-    global sock, read_length, read_file, plot_width, plot_hertz, raw_data, gps_data, write_mode, write_file, hk_units, xl_sheet
+    global receiver, read_length, read_file, plot_width, plot_hertz, ring, gps_track, gps_data, write_mode, write_file, write_index, hkunits, read_mode, format_file_name, bytes_ps, udp_address
 
+    read_mode = mode
     plot_hertz = hertz
     plot_width = width
+    sync_lock.reset()
+    continuity.reset()
+    gps_decoder.reset()
+    timer.reset()
+    timer.close_log()
+    if timing_log:
+        timer.open_log(timing_log)
     
     # Initialize a write file
     dir = dirname(dirname(abspath(__file__)))
+    if write_file is not None:
+        write_file.close()
+        write_index.close()
+        write_file = write_index = None
     write_mode = do_write
     if write_mode:
         if (write_file_name==""):
-            write_file = "Recording"+datetime.today().strftime('%Y-%m-%d')
+            write_file_name = "Recording"+datetime.today().strftime('%Y-%m-%d')
+        write_index = IndexWriter(dir+"/recordings/"+write_file_name+".udp")
         write_file = open(dir+"/recordings/"+write_file_name+".udp", "ab")
 
     # Load the excel format file    
-    xl_sheet = load_workbook(format_file, data_only=True).active
+    data_channels.clear()
+    all_data.clear()
+    format_file_name = format_file
+    format_spec = load_format(format_file)
 
     # Bytes/second
-    bytes_ps = getval("D3", int)
+    bytes_ps = format_spec["bytes_ps"]
     read_length = bytes_ps//plot_hertz
     read_length += 126 - (read_length%126)
 
     # Set up gps data dictionary
-    #gps_data = {gps_name:np.zeros([getval("D4", int)*width], float) for gps_name in GPS_NAMES_ID}
+    gps_track = CircularBuffer(25000, buffer=np.zeros(25000, dtype=GPS_DTYPE))
+    gps_data = {gps_name:gps_track.data[gps_name] for gps_name in GPS_NAMES_ID}
 
     # Set hk units
-    hk_units = do_hkunits
-
-    '''
-    # Plots
-    graph_rows = getval("D7", list)
-    for row_num in range(graph_rows[0], graph_rows[1]+1):
-        row = [getval("B"+str(row_num))]
-        i = 1
-        while row[-1] != "None":
-            row.append( getval(chr(ord("B")+i) + str(row_num)) )
-            i += 1
-        # Remove last cell "None"
-        row = row[:-1]
-        
-        if len(row) == 0:
-            continue
-        elif row[0][0] == '#':
-            add_channel(*row)
-    '''
-    '''
-    graph_rows = getval("D6", list)
-    for row_num in range(graph_rows[0],graph_rows[1]+1):
-        name = getval("D"+str(row_num), str)
-        numpoints = getval("I"+str(row_num), str)
-        graph_numpoints[name] = numpoints
-    '''
+    hkunits = do_hkunits
 
     # Channels
-    channel_rows = getval("D7", list)
-    for row_num in range(channel_rows[0],channel_rows[1]+1):
-        row = [getval(chr(i)+str(row_num),t) for i, t in zip(range(ord('C'),ord('C')+len(CHANNEL_ROW_TYPE)), CHANNEL_ROW_TYPE)]
+    for row in format_spec["channels"]:
         add_channel(*row)
 
     # Housekeeping
-    hk_rows = getval("D9", list)
-    for row_num in range(hk_rows[0], hk_rows[1]+1):
-        row = [getval(chr(i)+str(row_num),t) for i, t in zip(range(ord('C'), ord('C')+len(HK_ROW_TYPE)), HK_ROW_TYPE)]
+    for row in format_spec["housekeeping"]:
         add_housekeeping(*row)
-    '''
-        if (row[0]=="ACC"):
-            add_housekeeping(*row[1:7])
-        else:
-            add_housekeeping(*row[1:7])
-    '''
-            
-    '''
-    self.valuesWidget.show()
-    plotting.finish_creating()
-    ''' 
 
-    raw_data = np.zeros(bytes_ps)
+    compile_decode_plans()
+
+    # Readers write straight into the ring, the bytes left over from the last cycle stay in front of them
+    # A slab of the receiver can end with a whole datagram past read_length
+    ring = ByteRing(2*read_length + MAX_DATAGRAM + 2*PACKET_LENGTH)
     if read_mode == 0:
         print("Opening recording")
         read_file = open(read_file_name, "rb")
 
     elif read_mode == 1:
         print("Connecting Socket...")
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) 
-        sock.bind((udp_ip, udp_port))
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,bytes_ps) # Set the socket max read buffer so data doesn't overflow.
+        if receiver is not None:
+            receiver.stop()
+        receiver = UDPReceiver(udp_ip, int(udp_port), read_length, rcvbuf=bytes_ps)
+        receiver.start()
         print(f"Socket connected\nIP: {udp_ip}\nPort: {udp_port}")    
-        sock.setblocking(0)
+
+    elif read_mode == 3:
+        udp_address = (udp_ip, int(udp_port))
 
 
 
@@ -273,174 +229,234 @@ def parse() -> dict:
             }
         
     '''
-    global running, raw_data, last_ind_arr
+    global running
     running = True
     cur_length = 0
-    if read_mode == 1:
-        cur_length = min(read_length, read_file.tell())
-        raw_data[:cur_length] = np.fromfile(read_file, dtype=np.uint8, count=read_length)
-        if len(raw_data) == 0:
+    timer.begin()
+    if read_mode == 0:
+        cur_length = ring.readinto(read_file, read_length)
+        if cur_length == 0:
             print("Finished reading file")
+            read_file.close()
             running = False
             return
 
     else:
-        cur_length = 0
-        running = True
-        while (cur_length<read_length and running):
-            try:
-                raw_data[cur_length:cur_length+126] = np.frombuffer(sock.recv(126), np.uint8)
-                cur_length+=126
-            except BlockingIOError:
-                # Only process events again if it has been a tenth of a second
-                time.sleep(0.01)
-
-            except WindowsError:
-                print("Avoided socket error")
-                cur_length= 0
+        # The receiver thread hands over a cycle of data, or less when the stream slows down
+        while (cur_length==0 and running):
+            cur_length = receiver.readinto(ring, timeout=sock_wait)
 
         if (not running):
             return
 
-        '''
-    if (next_process_events==0):
-        draw_start_time = time.perf_counter()
-        app.process_events()
-        draw_time += time.perf_counter()-draw_start_time
-    next_process_events = 0 
-        '''
+    timer.lap("receive")
+    return process(cur_length)
+
+def stats() -> dict:
+    '''
+    Counts of the data received and parsed so far
+    '''
+    return {"frames": continuity.stats(),
+            "receiver": receiver.stats() if read_mode == 1 else async_receiver.stats() if read_mode == 3 and async_receiver is not None else None,
+            "ring_dropped_bytes": ring.dropped if ring is not None else 0,
+            "sync": sync_lock.stats(),
+            "stages_ms": timer.summary()}
 
+def process(cur_length) -> dict:
+    '''
+    Record and parse the last cur_length bytes added to the ring
+    '''
     if write_mode:
-        raw_data[:cur_length].tofile(write_file)
-    # Add the remaining bytes from the p
-    data_arr = np.concatenate([last_ind_arr, raw_data[:cur_length]])
-    # Must process the gui so it does not freeze
+        ring.latest(cur_length).tofile(write_file)
+        write_index.write(ring.latest(cur_length))
+        timer.lap("write")
+    # The remaining bytes from the last cycle are already in front of the new bytes
+    ring.consume(decode(ring.view()))
+    timer.end()
+    return all_data
 
+async def start_async(callback=None):
+    '''
+    Receive udp data on the running asyncio event loop instead of calling parse(), init() must be called first with mode=3
 
-    calc_start_time = time.perf_counter()
-    
-    inds = find_SYNC(data_arr)
+    Every cycle of data is parsed as soon as it arrives and callback is called with the dictionary parse() returns.
+    Returns the transport and AsyncUDPReceiver, close the transport to stop.
+    '''
+    global async_receiver
+    def on_data(num):
+        timer.begin()
+        data = process(num)
+        if callback is not None:
+            callback(data)
+    transport, async_receiver = await create_async_receiver(*udp_address, ring, read_length, on_data, rcvbuf=bytes_ps)
+    return transport, async_receiver
+
+def decode(data_arr) -> int:
+    '''
+    Parse every minor frame in data_arr into all_data
+
+    Returns the number of bytes that were used, the rest of data_arr has to be passed to the next call
+    '''
+    inds = sync_lock.find(data_arr)
     if len(inds)==0:
         print("No valid sync frames")
-        return
-
-    # Save last index for next cycle
-    last_ind_arr = data_arr[inds[-1]:]
-
+        timer.lap("sync")
+        # Keep the bytes that could be the start of a SYNC frame
+        return max(len(data_arr)-(len(SYNC)-1), 0)
+
+    # The last checked frame is only parsed once the frame after it is checked, unless the stream broke after it
+    cut = next_cut(inds)
+    continuity.update(*frame_counts(data_arr, inds, cut))
+    frame_inds = find_frames(data_arr, inds, cut)
+    timer.lap("sync")
+
+    # uint8 frames with the endianness swapped: [3, 2, 1, 0, 7, 6, 5, 4 ... 79, 78, 77, 76]
+    # Frame types are kept as row indices and only copied out when needed
+    minframes = MinorFrames(data_arr, frame_inds)
+    timer.lap("frames")
+
+    gps_track.write(gps_decoder.decode(gps_stream(minframes)))
+    timer.lap("gps")
+
+    # Every channel of a protocol is decoded at once
+    for frame_ind, (names, plan) in decode_plans.items():
+        for name, values in zip(names, plan.decode(minframes.frames, minframes.rows[frame_ind])):
+            all_data[name] = data_channels[name].new_data(values)
+    timer.lap("channels")
+
+    # Every board of a protocol is found in one pass over the housekeeping bytes, packets cut by the end of the batch are found in the next one
+    for frame_ind, (names, engine) in hk_engines.items():
+        for name, values in zip(names, engine.decode(minframes.frames, minframes.rows[frame_ind])):
+            all_data[name] = data_channels[name].new_data(values)
+    timer.lap("housekeeping")
+
+    # The frames from cut are parsed in the next cycle
+    return cut
+
+def find_frames(data_arr, inds, limit=None):
+    '''
+    Filter the SYNC indices found in data_arr down to the minor frames that are parsed
+    Frames starting at or after limit are left for the next chunk
+    '''
     # Check for all indexes if the length between them is correct
     inds = inds[:-1][(np.diff(inds) == PACKET_LENGTH)]
 
     #
     inds = inds[:-1][(np.diff(data_arr[inds + 6]) != 0)]
 
-    all_minframes = data_arr[inds[:, None] + e].astype(int)
+    if limit is not None:
+        inds = inds[inds < limit]
+    return inds
 
-    # Frame types
-    protocol_minframes = [all_minframes,
-        all_minframes[np.where(all_minframes[:, 57] & 3 == 1)],
-        all_minframes[np.where(all_minframes[:, 57] & 3 == 2)],
-        all_minframes[np.where(all_minframes[:, 5] % 2 == 1)],
-        all_minframes[np.where(all_minframes[:, 5] % 2 == 0)]]
-    
+def gps_stream(minframes):
+    '''
+    The gps bytes of the minor frames in order
+    '''
     # Gps bytes are at 6, 26, 46, 66 when the next byte == 128
-    gps_raw_data = all_minframes[:, [6, 26, 46, 66]].flatten()
-    gps_check = all_minframes[:, [7, 27, 47, 67]].flatten()
-    gps_data_d = gps_raw_data[np.where(gps_check==128)]
-    
-    # Gps indices
-    gps_inds = np.array([])
-    if len(gps_data_d)>0:
-        gps_inds = find_RV(gps_data_d)
-    
-    # Check if last index is inside the gps stream
-    if len(gps_inds)>0 and gps_inds[-1]+RV_LEN>len(gps_data_d):
-        gps_inds = gps_inds[:-1]
-
-    # Parse gps data when there are bytes available
-    if len(gps_inds)>0:
-        if len(gps_data_d) - gps_inds[-1] < RV_LEN:
-            gps_inds = gps_inds[:-1]
-
-        gpsmatrix = gps_data_d[np.add.outer(gps_inds, np.arange(48))].astype(np.uint32)
-
-        # Number of rv packets
-        num_RV = np.shape(gpsmatrix)[0]
-
-        # All rv_packets whose checksum is equal to the last 2 bytes
-        valid_rv_packets = np.zeros(num_RV, dtype=bool)
-        for i in range(num_RV):
-            valid_rv_packets[i] = crc_16(gpsmatrix[i,:-3]) == (gpsmatrix[i, -2]<<8) | gpsmatrix[i, -3]
-        gpsmatrix = gpsmatrix[np.where(valid_rv_packets)].astype(np.uint64)
-
-        # Get num_rv after eliminating frames that did not pass the checksum
-        num_RV = np.shape(gpsmatrix)[0]
-
-        # Signed position data
-        gps_pos_ecef = (((gpsmatrix[:, [12, 20, 28]] << 32) |
-                        (gpsmatrix[:, [11, 19, 27]] << 24) |
-                        (gpsmatrix[:, [10, 18, 26]] << 16) |
-                        (gpsmatrix[:, [ 9, 17, 25]] <<  8) |
-                        (gpsmatrix[:, [16, 24, 32]])) - 
-                        ((gpsmatrix[:, [12, 20, 28]]>=128)*(1<<40))).transpose()/10000
-        
-        gps_vel_ecef = (((gpsmatrix[:, [36, 40, 44]] << 20) |
-                            (gpsmatrix[:, [35, 39, 43]] << 12) |
-                            (gpsmatrix[:, [34, 38, 42]] << 4)  |
-                            (gpsmatrix[:, [33, 37, 41]] >> 4)) -
-                            ((gpsmatrix[:, [36, 40, 44]]>=128)*(1<<28))).transpose()/10000
-
-
-        # Replace old data with new data from the start of the array
-        gps_data["lat"][:num_RV], gps_data["lon"][:num_RV],  gps_data["alt"][:num_RV] = ecef2geodetic(*gps_pos_ecef) # Use ecef2geodetic to get position in lat, lon, alt
-
-        gps_data["veast"][:num_RV], gps_data["vnorth"][:num_RV], gps_data["vup"][:num_RV] = ecef2enuv(*gps_vel_ecef, gps_data["lat"][:num_RV], gps_data["lon"][:num_RV]) # Use ecef2enuv to get velocity in east, north, up 
-
-        gps_data["shorz"][:num_RV] = np.hypot(gps_data["veast"][:num_RV], gps_data["vnorth"][:num_RV]) # Get horizontal speed from the hypotonuse of east and north velocity
-
-        gps_data["numsats"][:num_RV] = gpsmatrix[:, 15] & 0b00011111 # 0001-1111 -> take 5 digits
-        
-        # Shift data to the left by num_RV and set the last parsed value as text
-        for val in GPS_NAMES_ID:
-            gps_data[val] = np.roll(gps_data[val], -num_RV)
-        
-        '''
-            gps_values[val].setText(f"{gps_data[val][-1] : .{DEC_PLACES}f}") #.rstrip('0') to remove zeros
+    gps_raw_data = minframes.frames[:, [6, 26, 46, 66]].flatten()
+    gps_check = minframes.frames[:, [7, 27, 47, 67]].flatten()
+    return gps_raw_data[np.where(gps_check==128)]
 
+def parse_recording(read_file_name, chunk_size=PACKET_LENGTH*50000, executor=None) -> dict:
+    '''
+    Parse a whole recording as fast as possible instead of (1/plot_hertz) seconds at a time, init() must be called first
 
-        for gps_markers in gps2d_points:
-            gps_markers.set_data(pos=np.transpose(np.array([gps_data["lon"], gps_data["lat"]])) ,face_color="#ff0000", edge_width=0, size=3, symbol='s')
-        lon3d = (gps_data["lon"]-lonlim[0])/(lonlim[1]-lonlim[0])
-        lat3d = (gps_data["lat"]-latlim[0])/(latlim[1]-latlim[0])
-        alt3d = (gps_data["alt"]-altlim[0])/(altlim[1]-altlim[0])
-        for gps_markers in gps3d_points:
-            gps_markers.set_data(pos=np.transpose(np.array([lon3d, lat3d, alt3d])) ,face_color="#ff0000", edge_width=0, size=3, symbol='s')
-        '''
+    The recording is memory mapped and parsed in chunks that start at SYNC frames.
+    The gps and housekeeping byte streams of every chunk are joined before they are parsed, so no packet is lost between chunks.
+    When an executor from recording_executor() is given the chunks are decoded in its processes, the result is the same.
+    The frames of the recording are counted in continuity.
 
+    Returns a dictionary with the full arrays:
+    dict = {
+            "PIP1" : [1, 2, 3 ...]            # Channels
+            ...
+            "hk_PIP" : [[34, 1, 2 ...], ...]  # Housekeeping, (10, packets)
+            ...
+            "lon" : [4, 5, 6 ...]             # GPS values, named as in GPS_NAMES_ID
+            ...
+            }
+    '''
+    reader = RecordingReader(read_file_name, PACKET_LENGTH)
+    chunks = reader.chunks(chunk_size)
+    reader.close()
 
-    for name in data_channels.keys():
-        dch = data_channels[name]
-        all_data[name] = dch.new_data(protocol_minframes[dch.frame_ind])
+    # Results come back in the order of the chunks
+    if executor is None:
+        results = [decode_recording_chunk(read_file_name, start, end) for start, end in chunks]
+    else:
+        starts, ends = zip(*chunks)
+        results = executor.map(decode_recording_chunk, [read_file_name]*len(chunks), starts, ends)
+
+    channel_chunks = {frame_ind:[] for frame_ind in decode_plans}
+    hk_streams = {frame_ind:[] for frame_ind in hk_engines}
+    gps_streams = []
+    continuity.reset()
+    for chunk_channels, chunk_hk, chunk_gps, counts in results:
+        continuity.update(*counts)
+        for frame_ind, block in chunk_channels.items():
+            channel_chunks[frame_ind].append(block)
+        for frame_ind, streams in chunk_hk.items():
+            hk_streams[frame_ind].append(streams)
+        gps_streams.append(chunk_gps)
+
+    recording_data = {}
+    for frame_ind, blocks in channel_chunks.items():
+        names, plan = decode_plans[frame_ind]
+        block = np.concatenate(blocks, axis=1) if blocks else np.zeros((len(names), 0), dtype=plan.dtype)
+        for name, values in zip(names, block):
+            recording_data[name] = values.astype(np.int64)
+    for frame_ind, chunk_streams in hk_streams.items():
+        names, engine = hk_engines[frame_ind]
+        # The chunks of each stream are joined so packets split between chunks are found
+        streams = [np.concatenate(parts) for parts in zip(*chunk_streams)] if chunk_streams else [np.zeros(0, dtype=np.uint8)]*len(engine.groups)
+        for name, values in zip(names, engine.unpack(streams)):
+            recording_data[name] = data_channels[name].units(values)
+    gps = decode_gps(np.concatenate(gps_streams) if gps_streams else np.zeros(0, dtype=np.uint8))
+    for name in GPS_NAMES_ID:
+        recording_data[name] = np.ascontiguousarray(gps[name])
+
+    return recording_data
+
+def recording_executor(workers=None) -> ProcessPoolExecutor:
+    '''
+    Processes for parse_recording() that each load the format file given to init()
+    workers defaults to the number of cores
+    '''
+    return ProcessPoolExecutor(workers, initializer=init_worker, initargs=(format_file_name, hkunits))
 
+def init_worker(format_file, do_hkunits):
+    # Workers only decode recordings, they never read a socket or write a recording
+    init(format_file, mode=2, do_hkunits=do_hkunits)
 
-    # Update digital accelerometer temperature
+def decode_recording_chunk(read_file_name, start, end):
     '''
-    acc_dig_temp_data[:len(protocol_minframes[2])] = ((protocol_minframes[2][:, 61]&15)<<8 | protocol_minframes[2][:, 62]).transpose()
-    acc_dig_temp_data = np.roll(acc_dig_temp_data, -len(protocol_minframes[2]))
-    
-    if acc_dig_temp != None:
-        acc_dig_temp.setText(f"{acc_dig_temp_data[-1]: .{DEC_PLACES}f}")
+    Decode the chunk of a recording from start to end
+
+    Returns the (channels, frames) block of every protocol in the DecodePlan dtype, the housekeeping byte streams,
+    the gps byte stream and the frame counts. The results are pickled back from the processes of recording_executor(),
+    so they are kept as few and as small arrays as possible.
+    The packets in the byte streams can continue into the next chunk so they are only parsed after joining every chunk.
     '''
+    reader = RecordingReader(read_file_name, PACKET_LENGTH)
+    minframes, counts = decode_chunk(reader.view(start, end), end-start)
 
-    #calc_time += time.perf_counter()-calc_start_time
+    channels = {frame_ind:plan.decode(minframes.frames, minframes.rows[frame_ind]).astype(plan.dtype) for frame_ind, (names, plan) in decode_plans.items()}
+    hk_streams = {frame_ind:engine.streams(minframes.frames, minframes.rows[frame_ind]) for frame_ind, (names, engine) in hk_engines.items()}
+    gps = gps_stream(minframes)
 
-    # Pause when reading a file
-    return all_data
+    del minframes
+    reader.close()
+    return channels, hk_streams, gps, counts
+
+def decode_chunk(data_arr, limit):
     '''
-    if (read_mode == 1):
-        pause_time = max((1/plot_hertz) - (time.perf_counter()-start_time), 0) 
-        time.sleep(pause_time)
-        start_time = time.perf_counter()
+    Minor frames of one chunk of a recording that start before limit and their frame_counts()
+    The chunk is searched completely for SYNC frames so the result does not depend on where the chunks are split
     '''
+    inds = find_SYNC(data_arr)
+    if len(inds)==0:
+        return MinorFrames(data_arr, inds), (np.zeros(0, dtype=np.uint8), 0)
+    return MinorFrames(data_arr, find_frames(data_arr, inds, limit)), frame_counts(data_arr, inds, limit)
 
 class Channel:
     def __init__(self, protocol, signed, byte_ind, bitmask):
@@ -456,7 +472,6 @@ class Channel:
             self.byte_info.append([ind, mask, shift])            
             bit_num += mask.bit_count()
 
-        # self.xlims = [0, numpoints]
         # Infer y limits from number of bits
         if self.signed:
             self.ylims = [-2**(bit_num-1), 2**(bit_num-1)]
@@ -465,100 +480,83 @@ class Channel:
 
         self.n = 0
         self.data = np.zeros(MAX_NUMPOINTS)
-        #self.datax = np.arange(MAX_NUMPOINTS)
-
-    def new_data(self, minframes):
-        self.n = len(minframes)
-        self.data[:self.n] = np.zeros(self.n)
-        for ind, mask, shift in self.byte_info:
-            if shift < 0:
-                self.data[:self.n] += (minframes[:, ind] & mask) >> abs(shift)
-            else:
-                self.data[:self.n] += (minframes[:, ind] & mask) << shift
-        
-        if self.signed:
-            self.data[:self.n] = self.data[:self.n]+(self.data[:self.n] >= self.ylims[1])*(2*self.ylims[0])
-
-        #sself.datay = np.roll(self.datay, -l)
 
-        #data = np.transpose(np.array([self.datax, self.datay]))
-        #self.line.set_data(pos=data, edge_width=0, size=1, face_color=self.color)
+    def new_data(self, values):
+        # values are decoded for every channel of the protocol at once by DecodePlan
+        self.n = len(values)
+        self.data[:self.n] = values
         return self.data[:self.n]
 
     def reset(self):
-        self.data = np.zeros(self.xlims[1])
-        #self.line.set_data(pos=np.transpose(np.array([self.datax, self.datay])), edge_width=0, size=1, face_color=self.color)
+        self.data = np.zeros(MAX_NUMPOINTS)
 
 class Housekeeping:
     def __init__(self,protocol, board_id, numpoints, b_ind, b_mask):
         self.frame_ind = PROTOCOLS.index(protocol)
+        self.board_id = board_id
         self.b_ind, self.b_mask = b_ind, b_mask 
-        print(self.b_ind, self.b_mask)
         self.rate = b_mask[0].bit_count()
-
-
-        print(self.rate)
-        self.ipf = len(self.b_ind) # indexes per frame
-        if self.rate == 8:
-            self.board_id = board_id
-            self.length = HK_LENGTH
-        elif self.rate == 4:
-            self.board_id = [board_id>>4, board_id&0xF]
-            self.length = HK_LENGTH*2
-        else:
-            print(self.rate)
+        if self.rate not in (8, 4):
             raise ValueError("Unsupported housekeeping rate")
 
         self.numpoints = int(numpoints*self.rate)
-
-        self.indcol = np.array(np.arange(10)//self.rate, dtype=np.uint8)[:, None]+1
         self.data = np.zeros((10, self.numpoints))
         self.maxhkrange = AVG_NUMPOINTS
 
-    def new_data(self, minframes):
-        minframes = minframes.astype(np.uint8)
-        self.n = len(minframes)
-        databuffer = np.zeros(self.n*self.ipf, dtype=np.uint8)
-        for i in range(self.ipf):
-            databuffer[np.arange(self.n)*self.ipf+i] = minframes[:, self.b_ind[i]] & self.b_mask[i]
-        if self.rate == 8: # ACC, mNLP, PIP
-            inds = np.where(databuffer == self.board_id)[0]
-            inds = inds[np.where(np.diff(inds) == self.length)[0]]
-            if inds.size != 0:
-                self.data[:, :inds.size] = databuffer[self.indcol + inds]
-                
-
-        elif self.rate == 4: # EFP
-            inds = np.where( (databuffer==self.board_id[0])[:-1] & (databuffer==self.board_id[1])[1:])[0]
-            inds = inds[np.where(np.diff(inds) == self.length)[0]][:-1]
-            self.data[:, :inds.size] = databuffer[self.indcol + inds]<<4 | databuffer[self.indcol+1 + inds]
-
-        if hkunits:
-            self.data[:, :inds.size] = HK_COEF * (self.data[:, :inds.size]*2.5/256 - 0.5*2.5/256) + HK_ADD
-         
-
-        #self.data = np.roll(self.data, -inds.size, axis=1)
-        
+    def units(self, values):
         '''
-        hkrange = min(self.maxhkrange, inds.size)
-    
-        for edit, data_row in zip(self.values, self.data):
-            if edit.isEnabled():
-                if hkrange==0:
-                    edit.setText("null")
-                else:
-                    edit.setText(f"{np.average(data_row[-hkrange:]): .{DEC_PLACES}f}")
+        Housekeeping counts converted to units when hkunits is set
         '''
+        if hkunits:
+            return HK_COEF * (values*2.5/256 - 0.5*2.5/256) + HK_ADD
+        return values
+
+    def new_data(self, values):
+        # values are found for every board of the protocol at once by HousekeepingEngine
+        self.n = min(values.shape[1], self.numpoints)
+        self.data[:, :self.n] = self.units(values[:, :self.n])
+        return self.data[:, :self.n]
 
-        return self.data[:self.n]
     def reset(self):
         self.data = np.zeros((10, self.numpoints))
-        for value in self.values:
-            value.setText("")
 
-if __name__ == "__main__":
-    init(format_file="C:/Users/ayash/Programming/vortex_parser/lib/test.xlsx",
-         udp_ip="127.0.0.1",
-         udp_port=5000)
+def write_columns(recording_data, out_dir) -> None:
+    '''
+    Save every array of a parse_recording() dictionary as its own .npy file in out_dir
+    Single columns can be loaded later without reading the rest with np.load(path, mmap_mode='r')
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    for name, values in recording_data.items():
+        np.save(os.path.join(out_dir, name.replace("/", "_").replace("\\", "_")+".npy"), values)
 
-    print(parse())
+def decode_recordings(format_file, recordings, out_dir, do_hkunits=1, chunk_size=PACKET_LENGTH*50000, workers=1) -> None:
+    '''
+    Decode whole recordings and write the arrays of each one to out_dir/<recording name>/
+    workers processes decode the chunks of each recording, 0 uses every core
+    '''
+    init(format_file, mode=2, do_hkunits=do_hkunits)
+    executor = recording_executor(workers or None) if workers != 1 else None
+    for recording in recordings:
+        start_time = time.perf_counter()
+        recording_data = parse_recording(recording, chunk_size, executor)
+        decode_time = time.perf_counter()-start_time
+
+        write_columns(recording_data, os.path.join(out_dir, splitext(basename(recording))[0]))
+        size = os.path.getsize(recording)
+        print(f"{recording}: {size/1e6:.1f} MB in {decode_time:.2f} s ({size/1e6/max(decode_time, 1e-9):.1f} MB/s)")
+        print("    "+", ".join(f"{key} {value}" for key, value in continuity.stats()["total"].items()))
+    if executor is not None:
+        executor.shutdown()
+
+if __name__ == "__main__":
+    import argparse
+    arg_parser = argparse.ArgumentParser(description="Decode udp recordings without the gui")
+    arg_parser.add_argument("format_file", help="Excel format file")
+    arg_parser.add_argument("recordings", nargs="+", help="Recordings to decode")
+    arg_parser.add_argument("-o", "--out", default=".", help="Directory to write a folder of .npy arrays for each recording to")
+    arg_parser.add_argument("-j", "--workers", type=int, default=1, help="Processes decoding each recording, 0 for one per core")
+    arg_parser.add_argument("--counts", action="store_true", help="Keep housekeeping values in counts instead of units")
+    arg_parser.add_argument("--chunk-size", type=int, default=PACKET_LENGTH*50000, help="Bytes of a recording decoded at once")
+    args = arg_parser.parse_args()
+
+    decode_recordings(args.format_file, args.recordings, args.out, do_hkunits=not args.counts, chunk_size=args.chunk_size, workers=args.workers)
@@ -5,18 +5,23 @@ Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
 by Yash Jain
 """
 import time, math
-import socket
 
 import numpy as np
 
 from vispy import scene, plot, app
 from vispy.visuals.transforms import STTransform, MatrixTransform
 
-from pymap3d.ecef import ecef2geodetic, ecef2enuv
-
-from scipy.io import loadmat
-
 import parsing
+from gps import GPSDecoder, GPS_DTYPE
+from sync import SyncLock
+from decodeplan import DecodePlan
+from housekeeping import HousekeepingEngine
+from buffers import ByteRing, CircularBuffer
+from frames import MinorFrames, next_cut, frame_counts
+from continuity import ContinuityTracker
+from instrument import StageTimer
+from receiver import UDPReceiver, MAX_DATAGRAM
+from traces import Trace, index_buffer
 
 SYNC = [64, 40, 107, 254]
 MINFRAME_LEN = 2 * 40
@@ -40,13 +45,14 @@ sock_rep = int(sock_timeout/sock_wait)
 plot_width = 5
 do_write = False
 write_file = None
+write_index = None # IndexWriter of write_file
 
 HK_NAMES = ["Temp1", "Temp2", "Temp3", "Int. Temp", "V Bat", "-12 V", "+12 V", "+5 V", "+3.3 V", "VBat Mon", "Dig ACC"]
 GPS_NAMES = ["Longitude (deg)", "Latitude (deg)", "Altitude (km)", "vEast (m/s)", "vNorth (m/s)", "vUp (m/s)", "Horz. Speed (m/s)", "Num Sats"]
 GPS_NAMES_ID = ["lon", "lat", "alt", "veast", "vnorth", "vup", "shorz", "numsats"]
 
 acc_dig_temp = None
-acc_dig_temp_data = np.zeros(25000, np.uint32)
+acc_dig_temp_data = CircularBuffer(25000, dtype=np.uint32)
 # Housekeeping coefficients and constants for units
 do_hkunits = True
 HK_COEF = np.array([-76.9231    , -76.9231, -76.9231, -76.9231, 16, 6.15, 7.329, 3, 2, 2], dtype=np.float64) [:, None]
@@ -59,7 +65,10 @@ figures = {}
 plot_graphs = []
 map_graphs = []
 
-data_channels = {protocol:[] for protocol in PROTOCOLS} # Sort channels and hk by protocol
+data_channels = {protocol:[] for protocol in PROTOCOLS} # Sort channels by protocol
+hk_channels = {protocol:[] for protocol in PROTOCOLS}   # Sort housekeeping by protocol
+decode_plans = {protocol:DecodePlan([]) for protocol in PROTOCOLS} # Decodes every channel of a protocol at once
+hk_engines = {protocol:HousekeepingEngine([]) for protocol in PROTOCOLS} # Finds the packets of every board of a protocol at once
 gps2d_points = []
 gps3d_points = []
 
@@ -68,34 +77,24 @@ lonlim = [0, 1]
 altlim = [0, 100]
 
 close_signal = None
+
+# Set while parse() runs so stats() can read them
+receiver = None
+ring = None
+sync_lock = None
+continuity = ContinuityTracker()
+timer = StageTimer() # Time of each stage of the main loop
+timing_log = None    # File name to write the stage times to as JSON lines
 # Allocate memory for gps data
-gps_data = {gps_name:np.zeros(25000, float) for gps_name in GPS_NAMES_ID}
+gps_track = CircularBuffer(25000, buffer=np.zeros(25000, dtype=GPS_DTYPE))
+# Each gps value is a field of the track, so these views never have to be replaced
+gps_data = {gps_name:gps_track.data[gps_name] for gps_name in GPS_NAMES_ID}
+gps_decoder = GPSDecoder() # Keeps the end of the gps stream between cycles
 gps_values = {}
 
 running = True
 closing = False
 
-# Swap endianness: [3, 2, 1, 0, 7, 6, 5, 4 ... 79, 78, 77, 76]
-e = np.arange(MINFRAME_LEN)
-for i in range(0, MINFRAME_LEN, 4):
-    e[i:i+4] = e[i:i+4][::-1]
-
-sync_arr = np.array(SYNC)
-target_sync = np.dot(sync_arr, sync_arr)
-def find_SYNC(seq):
-    candidates = np.where(np.correlate(seq, sync_arr, mode='valid') == target_sync)[0]
-    check = candidates[:, np.newaxis] + np.arange(4)
-    mask = np.all((np.take(seq, check) == sync_arr), axis=-1)
-    return candidates[mask] 
-
-rv_arr = np.array(RV_HEADER)
-target_rv = np.dot(rv_arr, rv_arr)
-def find_RV(seq):
-    candidates = np.where(np.correlate(seq, rv_arr, mode='valid') == target_rv)[0]
-    check = candidates[:, np.newaxis] + np.arange(5)
-    mask = np.all((np.take(seq, check) == rv_arr), axis=-1)
-    return candidates[mask]
-
 def set_hkunits(hkunits):
     global do_hkunits
     do_hkunits = hkunits
@@ -129,7 +128,7 @@ def on_key_press(key):
                 map2d.reset_bounds()
 
 def on_close(event):
-    global running, closing, windows, figures, plot_graphs, data_channels, housekeeping_arr, channels_arr
+    global running, closing, windows, figures, plot_graphs, data_channels, hk_channels, decode_plans, hk_engines
     if closing:
         return
     running = False
@@ -143,8 +142,12 @@ def on_close(event):
     figures.clear()
     plot_graphs.clear()
     [obj_arr.clear() for obj_arr in data_channels.values()] # Sort channels and hk by protocol
+    [obj_arr.clear() for obj_arr in hk_channels.values()]
+    decode_plans = {protocol:DecodePlan([]) for protocol in PROTOCOLS}
+    hk_engines = {protocol:HousekeepingEngine([]) for protocol in PROTOCOLS}
     
-    [gps_data_arr.fill(0) for gps_data_arr in gps_data.values()]
+    gps_track.fill(0)
+    acc_dig_temp_data.fill(0)
     
     closing = False
 
@@ -168,9 +171,12 @@ def add_channel(color, protocol, signed, *byte_info):
     byte_info = [int(i) for i in byte_info]
     # Take last added graph
     graph = plot_graphs[-1]
+    # Every channel of a graph reads its x values from the same buffer
+    if graph.trace_index is None:
+        graph.trace_index = index_buffer(graph.xlims[1])
     
-    channel = Channel(color, signed, graph.xlims[1], *byte_info)
-    graph.add_line(channel.line)
+    channel = Channel(color, signed, graph.xlims[1], graph.trace_index, *byte_info)
+    graph.add_trace(channel.line)
 
     # Graph must fit the channel data
     graph.ylims[0] = min(graph.ylims[0], channel.ylims[0])
@@ -199,17 +205,17 @@ def add_map(figure, name, row, col, type):
 
     map_graphs.append(fig[row, col])
 
-def add_housekeeping(protocol, board_id, length, numpoints, byte_ind, bitmask, hkvalues):
-    board_id = int(board_id)
-    length = int(length)
-    numpoints = int(numpoints)
-    byte_ind = [int(i) for i in byte_ind.split(',')] # takes list of ints
-    bitmask = [int(i) for i in bitmask.split(',')] # takes list of ints
-
-    housekeeping_ = Housekeeping(board_id, length, numpoints, byte_ind, bitmask, hkvalues)
-    data_channels[protocol].append(housekeeping_)
+def add_housekeeping(name, numpoints, protocol, board_id, byte_ind, bitmask, hkvalues):
+    # Rows of the compiled format, byte_ind and bitmask are lists of ints
+    housekeeping_ = Housekeeping(int(board_id), int(numpoints), [int(i) for i in byte_ind], [int(i) for i in bitmask], hkvalues)
+    hk_channels[protocol].append(housekeeping_)
 
 def finish_creating():
+    # The channels cannot change after this, so the byte tables of each protocol are only built once
+    for protocol in PROTOCOLS:
+        decode_plans[protocol] = DecodePlan(data_channels[protocol])
+        hk_engines[protocol] = HousekeepingEngine(hk_channels[protocol])
+
     for graph in plot_graphs:
         graph.reset_bounds()
         graph.add_gridlines()
@@ -218,16 +224,17 @@ def finish_creating():
         fig.show()
 
 def reset_graphs():
-    for obj_arr in data_channels.values():
+    for obj_arr in list(data_channels.values())+list(hk_channels.values()):
         for obj in obj_arr:
             obj.reset()
     
-    for _gps in gps_data.values():
-        _gps.fill(0)
+    gps_track.fill(0)
+    acc_dig_temp_data.fill(0)
     
 
 def set_map(map_file):
     global latlim, lonlim
+    from scipy.io import loadmat # Only needed once a map is picked
 
     gpsmap = loadmat(map_file)
     latlim = gpsmap['latlim'][0]
@@ -254,21 +261,8 @@ def set_map(map_file):
             map_graph.xaxis.domain = lonlim
             map_graph.yaxis.domain = latlim
 
-def crc_16(arr):
-    crc = 0
-    for i in arr:
-        crc ^= (i<<8)
-        for i in range(0,8):
-            if (crc&0x8000)>0:
-                crc <<= 1
-                crc ^= 0x1021
-            else:
-                crc <<= 1
-        crc &= (1<<16)-1
-    return crc
-
 def parse(read_mode, plot_hertz, read_file_name, udp_ip, udp_port):
-        global running, gps_data, acc_dig_temp_data, sock_rep, sock_wait
+        global running, sock_rep, sock_wait, receiver, ring, sync_lock
         # Read length is the bytes in each hertz
         # Must be multiple of 126 since that is datagram length
         read_length = bytes_ps//plot_hertz
@@ -278,158 +272,111 @@ def parse(read_mode, plot_hertz, read_file_name, udp_ip, udp_port):
         if read_mode == 0:
             print("Opening recording")
             read_file = open(read_file_name, "rb")
-            raw_data = np.zeros(read_length)
 
         elif read_mode == 1:
             print("Connecting Socket...")
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) 
-            sock.bind((udp_ip, udp_port))
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,620000)
+            # Datagrams are received on their own thread and handed over a cycle of data at a time
+            receiver = UDPReceiver(udp_ip, udp_port, read_length)
+            receiver.start()
             print(f"Socket connected\nIP: {udp_ip}\nPort: {udp_port}")    
-            sock.setblocking(0)
 
-        
-        raw_data = np.zeros(read_length, np.uint8)
+        # Readers write straight into the ring, the bytes left over from the last cycle stay in front of them
+        # A slab of the receiver can end with a whole datagram past read_length
+        ring = ByteRing(2*read_length + MAX_DATAGRAM + 2*PACKET_LENGTH)
         
         start_time = time.perf_counter()
-        calc_time = 0
-        draw_time = 0
 
-        last_ind_arr=np.array([])
+        sync_lock = SyncLock(PACKET_LENGTH)
+        continuity.reset()
+        # Packets cut by the end of one batch are finished in the next, nothing is kept from an earlier run
+        gps_decoder.reset()
+        for engine in hk_engines.values():
+            engine.reset()
+        timer.reset()
+        if timing_log is not None:
+            timer.open_log(timing_log)
 
         next_process_events = 0
         # Main loop
         print("Starting Parsing")
         running = True
         while running:
+            timer.begin()
             if read_mode == 0:
-                raw_data = np.fromfile(read_file, dtype=np.uint8, count=read_length)
-                if len(raw_data) == 0:
+                read_num = ring.readinto(read_file, read_length)
+                if read_num == 0:
                     print("Finished reading file")
                     running = False
                     continue
 
             else:
                 read_num = 0
-                while (read_num<read_length and running):
-                    try:
-                        raw_data[read_num:read_num+126] = np.frombuffer(sock.recv(126), np.uint8)
-                        read_num+=126
-                    except BlockingIOError:
-                        # Only process eventts again if it has been a tenth of a second
+                while (read_num==0 and running):
+                    read_num = receiver.readinto(ring)
+                    if read_num==0:
+                        # Only process events again if it has been a tenth of a second
                         if (time.perf_counter()>next_process_events):
+                            timer.lap("receive")
                             app.process_events()
+                            timer.lap("render")
                             next_process_events = time.perf_counter()+0.1
-                        else:
-                            time.sleep(0.01)
-
-                    except WindowsError:
-                        print("Avoided socket error")
-                        read_num = 0
 
                 if (not running):
                     continue
+            timer.lap("receive")
 
             if (next_process_events==0):
-                draw_start_time = time.perf_counter()
                 app.process_events()
-                draw_time += time.perf_counter()-draw_start_time
+                timer.lap("render")
             next_process_events = 0 
 
             if do_write:
-                raw_data.tofile(write_file)
-            # Add the remaining bytes from the p
-            data_arr = np.concatenate([last_ind_arr, raw_data])
-            # Must process the gui so it does not freeze
-
-
-            calc_start_time = time.perf_counter()
-            
-            inds = find_SYNC(data_arr)
+                ring.latest(read_num).tofile(write_file)
+                if write_index is not None:
+                    write_index.write(ring.latest(read_num))
+                timer.lap("write")
+            # The remaining bytes from the last cycle are already in front of the new bytes
+            data_arr = ring.view()
+
+            inds = sync_lock.find(data_arr)
             if len(inds)==0:
                 print("No valid sync frames")
+                # Keep the bytes that could be the start of a SYNC frame
+                ring.consume(max(len(data_arr)-(len(SYNC)-1), 0))
+                timer.lap("sync")
+                timer.end()
                 continue
 
-            # Save last index for next cycle
-            last_ind_arr = data_arr[inds[-1]:]
+            # Save the frames that can not be checked yet for next cycle
+            cut = next_cut(inds)
+            ring.consume(cut)
+            continuity.update(*frame_counts(data_arr, inds, cut))
 
             # Check for all indexes if the length between them is correct
             inds = inds[:-1][(np.diff(inds) == PACKET_LENGTH)]
 
             #
             inds = inds[:-1][(np.diff(data_arr[inds + 6]) != 0)]
+            timer.lap("sync")
 
-            all_minframes = data_arr[inds[:, None] + e].astype(int)
-            #print(all_minframes)
-
-            # Frame types
-            protocol_minframes = [all_minframes,
-                all_minframes[np.where(all_minframes[:, 57] & 3 == 1)],
-                all_minframes[np.where(all_minframes[:, 57] & 3 == 2)],
-                all_minframes[np.where(all_minframes[:, 5] % 2 == 1)],
-                all_minframes[np.where(all_minframes[:, 5] % 2 == 0)]]
+            # uint8 frames with the endianness swapped: [3, 2, 1, 0, 7, 6, 5, 4 ... 79, 78, 77, 76]
+            # Frame types are kept as row indices and only copied out when needed
+            minframes = MinorFrames(data_arr, inds)
+            timer.lap("frames")
             
             # Gps bytes are at 6, 26, 46, 66 when the next byte == 128
-            gps_raw_data = all_minframes[:, [6, 26, 46, 66]].flatten()
-            gps_check = all_minframes[:, [7, 27, 47, 67]].flatten()
+            gps_raw_data = minframes.frames[:, [6, 26, 46, 66]].flatten()
+            gps_check = minframes.frames[:, [7, 27, 47, 67]].flatten()
             gps_data_d = gps_raw_data[np.where(gps_check==128)]
             
-            # Gps indices
-            gps_inds = np.array([])
-            if len(gps_data_d)>0:
-                gps_inds = find_RV(gps_data_d)
-            
-            # Check if last index is inside the gps stream
-            if len(gps_inds)>0 and gps_inds[-1]+RV_LEN>len(gps_data_d):
-                gps_inds = gps_inds[:-1]
-
-            # Parse gps data when there are bytes available
-            if len(gps_inds)>0:
-                if len(gps_data_d) - gps_inds[-1] < RV_LEN:
-                    gps_inds = gps_inds[:-1]
-
-                gpsmatrix = gps_data_d[np.add.outer(gps_inds, np.arange(48))].astype(np.uint32)
-
-                # Number of rv packets
-                num_RV = np.shape(gpsmatrix)[0]
-
-                # All rv_packets whose checksum is equal to the last 2 bytes
-                valid_rv_packets = np.zeros(num_RV, dtype=bool)
-                for i in range(num_RV):
-                    valid_rv_packets[i] = crc_16(gpsmatrix[i,:-3]) == (gpsmatrix[i, -2]<<8) | gpsmatrix[i, -3]
-                gpsmatrix = gpsmatrix[np.where(valid_rv_packets)].astype(np.uint64)
-
-                # Get num_rv after eliminating frames that did not pass the checksum
-                num_RV = np.shape(gpsmatrix)[0]
-
-                # Signed position data
-                gps_pos_ecef = (((gpsmatrix[:, [12, 20, 28]] << 32) |
-                                (gpsmatrix[:, [11, 19, 27]] << 24) |
-                                (gpsmatrix[:, [10, 18, 26]] << 16) |
-                                (gpsmatrix[:, [ 9, 17, 25]] <<  8) |
-                                (gpsmatrix[:, [16, 24, 32]])) - 
-                                ((gpsmatrix[:, [12, 20, 28]]>=128)*(1<<40))).transpose()/10000
-                
-                gps_vel_ecef = (((gpsmatrix[:, [36, 40, 44]] << 20) |
-                                 (gpsmatrix[:, [35, 39, 43]] << 12) |
-                                 (gpsmatrix[:, [34, 38, 42]] << 4)  |
-                                 (gpsmatrix[:, [33, 37, 41]] >> 4)) -
-                                 ((gpsmatrix[:, [36, 40, 44]]>=128)*(1<<28))).transpose()/10000
-
-
-                # Replace old data with new data from the start of the array
-                gps_data["lat"][:num_RV], gps_data["lon"][:num_RV],  gps_data["alt"][:num_RV] = ecef2geodetic(*gps_pos_ecef) # Use ecef2geodetic to get position in lat, lon, alt
-
-                gps_data["veast"][:num_RV], gps_data["vnorth"][:num_RV], gps_data["vup"][:num_RV] = ecef2enuv(*gps_vel_ecef, gps_data["lat"][:num_RV], gps_data["lon"][:num_RV]) # Use ecef2enuv to get velocity in east, north, up 
-
-                gps_data["shorz"][:num_RV] = np.hypot(gps_data["veast"][:num_RV], gps_data["vnorth"][:num_RV]) # Get horizontal speed from the hypotonuse of east and north velocity
-
-                gps_data["numsats"][:num_RV] = gpsmatrix[:, 15] & 0b00011111 # 0001-1111 -> take 5 digits
-                
-                # Shift data to the left by num_RV and set the last parsed value as text
+            # Every RV packet completed by the batch is decoded at once
+            gps = gps_decoder.decode(gps_data_d)
+            if len(gps)>0:
+                # Add the new data after the newest data in the track and set the last parsed value as text
+                gps_track.write(gps)
+                last = gps_track.last()
                 for val in GPS_NAMES_ID:
-                    gps_data[val] = np.roll(gps_data[val], -num_RV)
-                    gps_values[val].setText(f"{gps_data[val][-1] : .{DEC_PLACES}f}") #.rstrip('0') to remove zeros
+                    gps_values[val].setText(f"{last[val] : .{DEC_PLACES}f}") #.rstrip('0') to remove zeros
 
 
                 for gps_markers in gps2d_points:
@@ -442,21 +389,28 @@ def parse(read_mode, plot_hertz, read_file_name, udp_ip, udp_port):
                     gps_markers.set_data(pos=np.transpose(np.array([lon3d, lat3d, alt3d])) ,face_color="#ff0000", edge_width=0, size=3, symbol='s')
 
 
+            timer.lap("gps")
+
             # check if plt_hertz time has elapsed, set do_update to true 
-            for d, minframes in zip(data_channels.values(), protocol_minframes):
-                for i in d:
-                    i.new_data(minframes)
+            for frame_ind, protocol in enumerate(PROTOCOLS):
+                plan = decode_plans[protocol]
+                for channel, values in zip(plan.channels, plan.decode(minframes.frames, minframes.rows[frame_ind])):
+                    channel.new_data(values)
+            timer.lap("channels")
+
+            for frame_ind, protocol in enumerate(PROTOCOLS):
+                engine = hk_engines[protocol]
+                for hk, values in zip(engine.boards, engine.decode(minframes.frames, minframes.rows[frame_ind])):
+                    hk.new_data(values)
 
             # Update digital accelerometer temperature
-            acc_dig_temp_data[:len(protocol_minframes[2])] = ((protocol_minframes[2][:, 61]&15)<<8 | protocol_minframes[2][:, 62]).transpose()
-            acc_dig_temp_data = np.roll(acc_dig_temp_data, -len(protocol_minframes[2]))
+            acc_bytes = minframes.take(2, [61, 62]).astype(np.uint32)
+            acc_dig_temp_data.write((acc_bytes[:, 0]&15)<<8 | acc_bytes[:, 1])
             
             if acc_dig_temp != None:
-                acc_dig_temp.setText(f"{acc_dig_temp_data[-1]: .{DEC_PLACES}f}")
-
-            calc_time += time.perf_counter()-calc_start_time
-
-
+                acc_dig_temp.setText(f"{acc_dig_temp_data.last(): .{DEC_PLACES}f}")
+            timer.lap("housekeeping")
+            timer.end()
             
             # Pause when reading a file
             if (read_mode == 0):
@@ -464,12 +418,26 @@ def parse(read_mode, plot_hertz, read_file_name, udp_ip, udp_port):
                 time.sleep(pause_time)
                 start_time = time.perf_counter()
         if (read_mode==1):
-            sock.close()
-        print(f"Calculation Time {calc_time}")
-        print(f"Drawing Time {draw_time}")
+            receiver.stop()
+            print(f"Received {receiver.datagrams} datagrams, dropped {receiver.dropped_datagrams} while decoding was behind")
+            receiver = None
+        timer.close_log()
+        print(f"Sync lock {sync_lock.lock_percentage():.1f}% (locked {sync_lock.lock_events} times, lost {sync_lock.unlock_events} times)")
+        print("Stage times (ms)" + "".join(f"\n    {stage:<13}" + "  ".join(f"{key} {value:7.2f}" for key, value in times.items())
+                                         for stage, times in timer.summary().items()))
+
+def stats():
+    '''
+    Counts of the data received and parsed so far as a dictionary
+    '''
+    return {"frames": continuity.stats(),
+            "receiver": receiver.stats() if receiver is not None else None,
+            "ring_dropped_bytes": ring.dropped if ring is not None else 0,
+            "sync": sync_lock.stats() if sync_lock is not None else None,
+            "stages_ms": timer.summary()}
 
 class Channel:
-    def __init__(self, color, signed, numpoints, *raw_byte_info):
+    def __init__(self, color, signed, numpoints, trace_index, *raw_byte_info):
         self.signed = signed
         self.color = color
 
@@ -494,86 +462,47 @@ class Channel:
         else:
             self.ylims = [0, 2**bit_num]
 
-        self.datay = np.zeros(numpoints)
-        self.datax = np.arange(numpoints)
-
-        self.line = scene.Markers(pos=np.transpose(np.array([self.datax, self.datay])), edge_width=0, size=1, face_color=self.color, antialias=False)
+        # The y values stay on the gpu and only the new ones are uploaded, the history scrolls in the shader
+        self.line = Trace(numpoints, trace_index, color=self.color, size=1)
+        self.datay = self.line.history
 
-    def new_data(self, minframes):
-        l = len(minframes)
-        self.datay[:l] = np.zeros(l)
-        for ind, mask, shift in self.byte_info:
-            if shift < 0:
-                self.datay[:l] += (minframes[:, ind] & mask) >> abs(shift)
-            else:
-                self.datay[:l] += (minframes[:, ind] & mask) << shift
-        
-        if self.signed:
-            self.datay[:l] = self.datay[:l]+(self.datay[:l] >= self.ylims[1])*(2*self.ylims[0])
-        self.datay = np.roll(self.datay, -l)
-
-        data = np.transpose(np.array([self.datax, self.datay]))
-        self.line.set_data(pos=data, edge_width=0, size=1, face_color=self.color)
+    def new_data(self, values):
+        # values are decoded for every channel of the protocol at once by DecodePlan
+        self.line.write(values)
 
     def reset(self):
-        self.datay = np.zeros(self.xlims[1])
-        self.line.set_data(pos=np.transpose(np.array([self.datax, self.datay])), edge_width=0, size=1, face_color=self.color)
+        self.line.reset()
 
 class Housekeeping:
-    def __init__(self, board_id, length, numpoints, b_ind, b_mask, values):
-
+    def __init__(self, board_id, numpoints, b_ind, b_mask, values):
+        self.board_id = board_id
         self.b_ind, self.b_mask = b_ind, b_mask 
         self.rate = self.b_mask[0].bit_count()/8
-
-        self.bpf = len(self.b_ind) # bytes per frame
-        if self.rate == 8/8:
-            self.board_id = board_id
-        elif self.rate == 4/8:
-            self.board_id = [board_id>>4, board_id&0xF]
-        else:
+        if self.rate not in (8/8, 4/8):
             raise ValueError("Unsupported housekeeping rate")
 
         self.numpoints = int(numpoints*self.rate)
-        self.length = 11//self.rate
-
-        self.indcol = np.array(np.arange(10)//self.rate, dtype=np.uint8)[:, None]+1
-        self.data = np.zeros((10, self.numpoints))
+        self.data = CircularBuffer(self.numpoints, rows=10)
         self.values = values
         self.maxhkrange = AVG_NUMPOINTS
 
-    def new_data(self, minframes):
-        minframes = minframes.astype(np.uint8)
-        databuffer = np.zeros(len(minframes)*self.bpf, dtype=np.uint8)
-        for i in range(self.bpf):
-            databuffer[np.arange(len(minframes))*self.bpf+i] = minframes[:, self.b_ind[i]] & self.b_mask[i]
-        if self.rate == 8/8: # ACC, mNLP, PIP
-            inds = np.where(databuffer == self.board_id)[0]
-            inds = inds[np.where(np.diff(inds) == self.length)[0]]
-            if inds.size != 0:
-                self.data[:, :inds.size] = databuffer[self.indcol + inds]
-                
-
-        elif self.rate == 4/8: # EFP
-            inds = np.where( (databuffer==self.board_id[0])[:-1] & (databuffer==self.board_id[1])[1:])[0]
-            inds = inds[np.where(np.diff(inds) == self.length)[0]][:-1]
-            self.data[:, :inds.size] = databuffer[self.indcol + inds]<<4 | databuffer[self.indcol+1 + inds]
-
+    def new_data(self, values):
+        # values are found for every board of the protocol at once by HousekeepingEngine
         if do_hkunits:
-            self.data[:, :inds.size] = HK_COEF * (self.data[:, :inds.size]*2.5/256 - 0.5*2.5/256) + HK_ADD
+            values = HK_COEF * (values*2.5/256 - 0.5*2.5/256) + HK_ADD
          
+        self.data.write(values)
+        hkrange = min(self.maxhkrange, values.shape[1])
 
-        self.data = np.roll(self.data, -inds.size, axis=1)
-        hkrange = min(self.maxhkrange, inds.size)
-
-        for edit, data_row in zip(self.values, self.data):
+        for edit, data_row in zip(self.values, self.data.latest(hkrange)):
             if edit.isEnabled():
                 if hkrange==0:
                     edit.setText("null")
                 else:
-                    edit.setText(f"{np.average(data_row[-hkrange:]): .{DEC_PLACES}f}")
+                    edit.setText(f"{np.average(data_row): .{DEC_PLACES}f}")
 
     def reset(self):
-        self.data = np.zeros((10, self.numpoints))
+        self.data.fill(0)
         for value in self.values:
             value.setText("")
 
@@ -597,6 +526,8 @@ class ScrollingPlotWidget(scene.Widget):
         self._configured = False
         self.visuals = []
         self.section_y_x = None
+        self.trace_index = None # Index buffer shared by the traces of a 2d plot
+        self.traces = []
 
         super(ScrollingPlotWidget, self).__init__(*args, **kwargs)
         self.grid = self.add_grid(spacing=0, margin=10)
@@ -673,6 +604,8 @@ class ScrollingPlotWidget(scene.Widget):
         self.plot_view.camera = 'panzoom'
         self.camera = self.plot_view.camera
         self.camera.set_range(x=self.xlims, y=self.ylims)
+        # The camera transform changes on every zoom, pan and resize
+        self.camera.transform.changed.connect(self.update_lod)
 
         self._configured = True
         self.xaxis.link_view(self.plot_view)
@@ -734,6 +667,24 @@ class ScrollingPlotWidget(scene.Widget):
         self.plot_view.add(line) 
         
         return line
+
+    def add_trace(self, trace):
+        self.plot_view.add(trace)
+        self.traces.append(trace)
+        self.update_lod()
+        return trace
+
+    def update_lod(self, event=None):
+        '''
+        Give every trace the visible range and pixel size, so it draws the min and max of each pixel column when zoomed out
+        '''
+        if not self.traces:
+            return
+        rect = self.camera.rect
+        scale = self.canvas.pixel_scale if self.canvas is not None else 1
+        width, height = self.plot_view.size[0]*scale, self.plot_view.size[1]*scale
+        for trace in self.traces:
+            trace.set_view(abs(rect.width), width, abs(rect.height)/max(height, 1))
     
     def add_gridlines(self):
         self.view_grid = scene.visuals.GridLines(color=(0, 0, 0, 0.5))
@@ -0,0 +1,218 @@
+"""
+Module to receive udp data on its own thread
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import asyncio, errno, socket, selectors, threading, queue
+
+import numpy as np
+
+DATAGRAM_LENGTH = 126 # Length of the telemetry datagrams
+MAX_DATAGRAM = 2048   # Datagrams up to this length are received, longer ones are counted as truncated
+
+class UDPReceiver(threading.Thread):
+    """
+    Thread that receives datagrams into preallocated slabs and hands full slabs to the decoder
+
+    The thread waits for the socket with a timeout, so it keeps receiving while the decoder and gui are busy.
+    Each wake up then drains every datagram that is already waiting with non-blocking recv_into calls. Datagrams are received
+    straight into the slab at the current offset, so no bytes objects are made for them.
+    A slab is handed over when it is full, or when the timeout passes with data in it so slow streams still
+    reach the decoder. Slabs go back to the thread after readinto() copies them, when none are free the
+    filled slab is dropped and its datagrams are counted in dropped_datagrams.
+    """
+    def __init__(self, udp_ip, udp_port, slab_size, num_slabs=8, rcvbuf=620000, timeout=0.1, max_datagram=MAX_DATAGRAM):
+        super().__init__(daemon=True)
+        self.slab_size = slab_size
+        self.max_datagram = max_datagram
+        # A datagram that fills max_datagram+1 bytes was longer than max_datagram
+        self.slabs = np.zeros((num_slabs, slab_size+max_datagram+1), dtype=np.uint8)
+
+        self.free = queue.Queue()
+        for i in range(1, num_slabs):
+            self.free.put(i)
+        self.full = queue.Queue(maxsize=num_slabs) # (slab, bytes)
+
+        self.datagrams = 0          # Datagrams received
+        self.bytes = 0              # Bytes received
+        self.dropped_datagrams = 0  # Datagrams dropped because the decoder was behind
+        self.dropped_slabs = 0
+        self.truncated = 0          # Datagrams longer than max_datagram, which are thrown away
+        self.socket_errors = 0      # Other errors from the socket, like ICMP port unreachable on Windows
+        self.wakeups = 0            # Times the thread woke up to receive
+
+        self.running = True
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf) # Set the socket max read buffer so data doesn't overflow.
+        self.sock.bind((udp_ip, udp_port))
+        self.sock.setblocking(False)
+        self.timeout = timeout
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+
+    def drain(self, view, num):
+        """
+        Receive every waiting datagram into view starting at num until the slab is full
+        Returns the new end of the data in view and the number of datagrams
+        Windows raises WSAEMSGSIZE for a datagram longer than the buffer instead of truncating it, it is counted as
+        truncated like on other platforms. Other socket errors are counted and skipped, so the datagrams drained
+        before them are always kept.
+        """
+        recv_into = self.sock.recv_into
+        size = self.max_datagram+1
+        datagrams = 0
+        while num < self.slab_size:
+            try:
+                n = recv_into(view[num:], size)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno in (errno.EMSGSIZE, getattr(errno, "WSAEMSGSIZE", None)):
+                    self.truncated += 1
+                    continue
+                self.socket_errors += 1
+                continue
+            if n > self.max_datagram:
+                self.truncated += 1
+            else:
+                num += n
+                datagrams += 1
+        return num, datagrams
+
+    def run(self):
+        slab = 0
+        view = memoryview(self.slabs[slab])
+        num = 0
+        num_datagrams = 0
+        while self.running:
+            try:
+                if self.selector.select(self.timeout):
+                    self.wakeups += 1
+                    new_num, datagrams = self.drain(view, num)
+                    self.datagrams += datagrams
+                    self.bytes += new_num-num
+                    num = new_num
+                    num_datagrams += datagrams
+                    if num < self.slab_size:
+                        continue
+                elif num == 0:
+                    continue
+            except OSError:
+                self.socket_errors += 1
+                continue
+
+            try:
+                next_slab = self.free.get_nowait()
+            except queue.Empty:
+                # The decoder is still holding every other slab, start this one over
+                self.dropped_datagrams += num_datagrams
+                self.dropped_slabs += 1
+            else:
+                self.full.put((slab, num))
+                slab = next_slab
+                view = memoryview(self.slabs[slab])
+            num = 0
+            num_datagrams = 0
+
+    def readinto(self, ring, timeout=0.01):
+        """
+        Copy the next received slab to the end of a ByteRing, returns the number of bytes or 0 if none came within timeout
+        A slab holds up to slab_size+max_datagram bytes, so the ring must have room for that many
+        """
+        try:
+            slab, num = self.full.get(timeout=timeout)
+        except queue.Empty:
+            return 0
+        ring.writable(num)[:] = self.slabs[slab, :num]
+        ring.commit(num)
+        self.free.put(slab)
+        return num
+
+    def stats(self):
+        return {"datagrams": self.datagrams, "bytes": self.bytes, "wakeups": self.wakeups, "truncated": self.truncated,
+                "socket_errors": self.socket_errors, "dropped_datagrams": self.dropped_datagrams, "dropped_slabs": self.dropped_slabs}
+
+    def stop(self):
+        # The thread wakes up within the socket timeout and exits before the socket is closed
+        self.running = False
+        if self.is_alive():
+            self.join()
+        self.selector.close()
+        self.sock.close()
+
+class AsyncUDPReceiver(asyncio.DatagramProtocol):
+    """
+    asyncio protocol that receives datagrams into a ByteRing and calls on_data(num) after every slab_size bytes
+
+    on_data is also called when timeout seconds pass with fewer bytes waiting, like the slabs of UDPReceiver.
+    Datagrams longer than the ring are counted as truncated. When the ring drops bytes that were not given
+    to on_data yet, they are counted in overrun and on_data only gets the bytes the ring still holds.
+    Create it on a running event loop with create_async_receiver().
+    """
+    def __init__(self, ring, slab_size, on_data, timeout=0.1, max_datagram=MAX_DATAGRAM):
+        self.ring = ring
+        self.slab_size = slab_size
+        self.on_data = on_data
+        self.timeout = timeout
+        self.max_datagram = min(max_datagram, ring.capacity())
+
+        self.pending = 0 # Bytes in the ring that were not given to on_data yet
+        self.flush_handle = None
+        self.transport = None
+
+        self.datagrams = 0
+        self.bytes = 0
+        self.truncated = 0
+        self.overrun = 0 # Bytes dropped by the ring before on_data got them
+        self.errors = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        n = len(data)
+        if n > self.max_datagram:
+            self.truncated += 1
+            return
+        self.ring.writable(n)[:] = np.frombuffer(data, dtype=np.uint8)
+        self.ring.commit(n)
+        self.pending += n
+        if self.pending > len(self.ring):
+            self.overrun += self.pending-len(self.ring)
+            self.pending = len(self.ring)
+        self.datagrams += 1
+        self.bytes += n
+
+        if self.pending >= self.slab_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.timeout, self.flush)
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.pending > 0:
+            num, self.pending = self.pending, 0
+            self.on_data(num)
+
+    def error_received(self, exc):
+        self.errors += 1
+
+    def connection_lost(self, exc):
+        self.flush()
+
+    def stats(self):
+        return {"datagrams": self.datagrams, "bytes": self.bytes, "truncated": self.truncated,
+                "dropped_bytes": self.ring.dropped, "overrun": self.overrun, "errors": self.errors}
+
+async def create_async_receiver(udp_ip, udp_port, ring, slab_size, on_data, rcvbuf=620000, timeout=0.1, max_datagram=MAX_DATAGRAM):
+    """
+    Bind a socket on the running event loop, returns the transport and AsyncUDPReceiver
+    Closing the transport stops receiving
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf) # Set the socket max read buffer so data doesn't overflow.
+    sock.bind((udp_ip, udp_port))
+    loop = asyncio.get_running_loop()
+    return await loop.create_datagram_endpoint(lambda: AsyncUDPReceiver(ring, slab_size, on_data, timeout, max_datagram), sock=sock)
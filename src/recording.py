@@ -0,0 +1,70 @@
+"""
+Module to read udp recordings without loading them into memory
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import numpy as np
+
+from sync import find_SYNC
+
+PACKET_LENGTH = 2 * 40 + 44
+
+class RecordingReader:
+    """
+    Recording file mapped into memory with np.memmap
+
+    chunks() splits the recording at SYNC frames that are followed by another SYNC frame exactly
+    PACKET_LENGTH bytes later, so every chunk can be parsed on its own.
+    """
+    def __init__(self, file_name, packet_length=PACKET_LENGTH):
+        self.file_name = file_name
+        self.packet_length = packet_length
+        self.data = np.memmap(file_name, dtype=np.uint8, mode='r')
+
+    def __len__(self):
+        return len(self.data)
+
+    def next_boundary(self, pos, window=None):
+        """
+        Index of the first verified SYNC frame at or after pos, or the length of the recording if there is none
+        """
+        if window is None:
+            window = 64*self.packet_length
+        while pos < len(self.data):
+            # Windows overlap by a packet so a pair of SYNC frames is never split between them
+            inds = find_SYNC(self.data[pos:pos+window+self.packet_length+4])
+            pairs = np.flatnonzero(np.diff(inds) == self.packet_length)
+            if len(pairs) > 0 and inds[pairs[0]] < window:
+                return pos+int(inds[pairs[0]])
+            pos += window
+        return len(self.data)
+
+    def boundaries(self, chunk_size):
+        """
+        Start of every chunk, followed by the length of the recording
+        """
+        bounds = [0]
+        while True:
+            bound = self.next_boundary(bounds[-1]+chunk_size)
+            if bound >= len(self.data):
+                break
+            bounds.append(bound)
+        bounds.append(len(self.data))
+        return bounds
+
+    def chunks(self, chunk_size):
+        """
+        (start, end) of every chunk in order
+        """
+        bounds = self.boundaries(chunk_size)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def view(self, start, end):
+        """
+        Bytes from start to end plus the next frame, which is needed to check the last frames before end
+        """
+        return self.data[start:min(end+self.packet_length+4, len(self.data))]
+
+    def close(self):
+        # np.memmap closes the file once it is no longer referenced
+        self.data = None
@@ -1,29 +1,219 @@
-import socket, time
-
-host = "127.0.0.1"
-port = 5000
-
-buffer_size = 126
-rep = 62000//buffer_size
-
-file_name = "recordings\VortEx_test02.udp"
-
-sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-f = open(file_name, "rb")
-data = f.read(buffer_size)
-
-start_time = time.perf_counter()
-print("Sending...")
-i=0
-while len(data)==126:
-    # Should run 10 times each second ~ 0.9 seconds sleep and 0.1 second of sending the code.
-    if (sock.sendto(data, (host, port))):
-        data = f.read(buffer_size)
-    if (i%rep==0):
-        time.sleep(0.09) 
-    i+=1
-print(i)
-print(time.perf_counter()-start_time)
-sock.close()
-f.close()
\ No newline at end of file
+"""
+Module to replay recordings or synthetic telemetry over udp at the rate it was recorded at
+
+Datagrams are sent at absolute deadlines from a monotonic clock, so time lost to one send is made up
+by the next ones instead of adding up. When the recording has a time index from frameindex.py the
+deadlines follow the recorded times, otherwise the data is sent at a constant rate.
+
+    python sendudp.py ../recordings/VortEx_test02.udp --speed 2
+    python sendudp.py --synth 30 --rate 620000 --loss 0.01 --reorder 0.01
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import os, socket, time
+
+import numpy as np
+
+from frameindex import FrameIndex
+from synth import TelemetrySynth, PACKET_LENGTH
+
+DATAGRAM_SIZE = PACKET_LENGTH
+BYTES_PS = PACKET_LENGTH * 5000 # Same default as parsing.bytes_ps
+READ_SIZE = 1 << 20
+SLEEP_MIN = 0.0005 # Deadlines closer than this are sent without sleeping
+
+def recording_datagrams(file_name, datagram_size=DATAGRAM_SIZE):
+    """
+    (byte offset, datagram) of a recording in order
+    """
+    data = np.memmap(file_name, dtype=np.uint8, mode='r')
+    for start in range(0, len(data), READ_SIZE):
+        chunk = data[start:start+READ_SIZE].tobytes()
+        for i in range(0, len(chunk), datagram_size):
+            yield start+i, chunk[i:i+datagram_size]
+
+def synth_datagrams(seconds, bytes_ps, num_channels=8, datagram_size=DATAGRAM_SIZE, seed=0):
+    """
+    (byte offset, datagram) of seconds of synthetic telemetry at bytes_ps
+    """
+    synth = TelemetrySynth(num_channels, seed=seed)
+    num_packets = int(seconds*bytes_ps/PACKET_LENGTH)
+    offset = 0
+    pending = b""
+    for start in range(0, num_packets, 10000):
+        pending += synth.packets(min(10000, num_packets-start)).tobytes()
+        end = len(pending)-len(pending) % datagram_size
+        for i in range(0, end, datagram_size):
+            yield offset+i, pending[i:i+datagram_size]
+        offset += end
+        pending = pending[end:]
+    if pending:
+        yield offset, pending
+
+def recorded_times(file_name):
+    """
+    Function from byte offset to seconds since the start of a recording, from its time index
+    None when the recording has no index or fewer than two time markers
+    """
+    if not FrameIndex.exists(file_name):
+        return None
+    index = FrameIndex(file_name)
+    markers = index.markers[index.markers['frame'] < len(index)]
+    if len(markers) < 2:
+        return None
+    offsets = index.frames['offset'][markers['frame']].astype(np.float64)
+    times = markers['time']-markers['time'][0]
+    # Data after the last marker keeps the average rate of the recording
+    rate = (offsets[-1]-offsets[0])/max(times[-1], 1e-9)
+    def offset_time(offset):
+        if offset > offsets[-1]:
+            return times[-1]+(offset-offsets[-1])/rate
+        return float(np.interp(offset, offsets, times))
+    return offset_time
+
+def impair(datagrams, loss=0.0, reorder=0.0, duplicate=0.0, seed=0, counts=None):
+    """
+    Drop, swap with the next datagram or send twice each datagram with the given probabilities
+    The byte offsets stay in order so reordered datagrams are still sent on time
+    Injected impairments are added to counts
+    """
+    rng = np.random.default_rng(seed)
+    if counts is None:
+        counts = {}
+    for key in ["lost", "reordered", "duplicated"]:
+        counts.setdefault(key, 0)
+    held = None
+    for offset, datagram in datagrams:
+        if loss and rng.random() < loss:
+            counts["lost"] += 1
+            continue
+        if held is not None:
+            yield offset, datagram
+            datagram, held = held, None
+        elif reorder and rng.random() < reorder:
+            counts["reordered"] += 1
+            held = datagram
+            continue
+        yield offset, datagram
+        if duplicate and rng.random() < duplicate:
+            counts["duplicated"] += 1
+            yield offset, datagram
+    if held is not None:
+        yield offset, held
+
+def replay(datagrams, host="127.0.0.1", port=5000, bytes_ps=BYTES_PS, speed=1.0, offset_time=None, report_period=1.0):
+    """
+    Send datagrams at speed times the rate they were recorded at, speed=0 sends them as fast as possible
+    offset_time gives the time of a byte offset, otherwise bytes_ps is used
+    Returns the counts and the rate that was achieved
+    """
+    if offset_time is None:
+        offset_time = lambda offset: offset/bytes_ps
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = (host, port)
+
+    sent = 0
+    sent_bytes = 0
+    first = None # Time of the first datagram
+    late = 0.0
+    max_late = 0.0
+    start_time = time.perf_counter()
+    next_report = start_time+report_period
+    report_sent, report_bytes, report_time = 0, 0, start_time
+    print(f"Sending to {host}:{port}...")
+    try:
+        for offset, datagram in datagrams:
+            if speed > 0:
+                t = offset_time(offset)
+                if first is None:
+                    # The clock starts at the first datagram so making the stream is not counted as late
+                    first = t
+                    start_time = report_time = time.perf_counter()
+                    next_report = start_time+report_period
+                deadline = start_time+(t-first)/speed
+                now = time.perf_counter()
+                if deadline-now > SLEEP_MIN:
+                    time.sleep(deadline-now)
+                    now = time.perf_counter()
+                if now > deadline:
+                    late += now-deadline
+                    max_late = max(max_late, now-deadline)
+
+            sock.sendto(datagram, address)
+            sent += 1
+            sent_bytes += len(datagram)
+
+            if report_period and sent % 64 == 0:
+                now = time.perf_counter()
+                if now >= next_report:
+                    print(f"{now-start_time:8.1f} s   {(sent-report_sent)/(now-report_time):10.0f} datagrams/s   "
+                          f"{(sent_bytes-report_bytes)/1e6/(now-report_time):8.2f} MB/s")
+                    report_sent, report_bytes, report_time = sent, sent_bytes, now
+                    next_report = now+report_period
+    except KeyboardInterrupt:
+        print("Stopped")
+    finally:
+        sock.close()
+
+    elapsed = time.perf_counter()-start_time
+    return {"datagrams": sent,
+            "bytes": sent_bytes,
+            "seconds": elapsed,
+            "datagrams_ps": sent/max(elapsed, 1e-9),
+            "bytes_ps": sent_bytes/max(elapsed, 1e-9),
+            "mean_late_ms": 1000*late/max(sent, 1),
+            "max_late_ms": 1000*max_late}
+
+if __name__ == "__main__":
+    import argparse
+    arg_parser = argparse.ArgumentParser(description="Replay a recording or synthetic telemetry over udp")
+    arg_parser.add_argument("recording", nargs="?", default="", help="Recording to replay")
+    arg_parser.add_argument("--synth", type=float, default=0, help="Send this many seconds of synthetic telemetry instead of a recording")
+    arg_parser.add_argument("--channels", type=int, default=8, help="Channels of the synthetic telemetry")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=5000)
+    arg_parser.add_argument("--rate", type=float, default=0, help="Bytes/second, by default from the time index of the recording, --format or "+str(BYTES_PS))
+    arg_parser.add_argument("--format", default="", help="Excel format file to take the bytes/second from")
+    arg_parser.add_argument("--speed", type=float, default=1.0, help="Multiplier of the rate, 0 sends as fast as possible")
+    arg_parser.add_argument("--datagram-size", type=int, default=DATAGRAM_SIZE, help="Bytes in each datagram")
+    arg_parser.add_argument("--loss", type=float, default=0.0, help="Probability of dropping a datagram")
+    arg_parser.add_argument("--reorder", type=float, default=0.0, help="Probability of swapping a datagram with the next one")
+    arg_parser.add_argument("--duplicate", type=float, default=0.0, help="Probability of sending a datagram twice")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    bytes_ps = args.rate or BYTES_PS
+    if not args.rate and args.format:
+        from formatfile import load_format
+        bytes_ps = int(load_format(args.format)["bytes_ps"])
+
+    offset_time = None
+    if args.synth:
+        datagrams = synth_datagrams(args.synth, bytes_ps, args.channels, args.datagram_size, args.seed)
+        target = bytes_ps
+    elif args.recording:
+        datagrams = recording_datagrams(args.recording, args.datagram_size)
+        if not args.rate:
+            offset_time = recorded_times(args.recording)
+        if offset_time is not None:
+            target = os.path.getsize(args.recording)/max(offset_time(os.path.getsize(args.recording)), 1e-9)
+            print("Using the recorded times")
+        else:
+            target = bytes_ps
+    else:
+        arg_parser.error("Give a recording or --synth")
+
+    counts = {}
+    if args.loss or args.reorder or args.duplicate:
+        datagrams = impair(datagrams, args.loss, args.reorder, args.duplicate, args.seed, counts)
+
+    results = replay(datagrams, args.host, args.port, bytes_ps, args.speed, offset_time)
+    print(f"Sent {results['datagrams']} datagrams, {results['bytes']/1e6:.2f} MB in {results['seconds']:.2f} s")
+    print(f"Achieved {results['bytes_ps']:.0f} bytes/s, {results['datagrams_ps']:.0f} datagrams/s", end="")
+    if args.speed > 0:
+        print(f" ({100*results['bytes_ps']/(target*args.speed):.1f}% of {target*args.speed:.0f} bytes/s)")
+        print(f"Late by {results['mean_late_ms']:.3f} ms on average, {results['max_late_ms']:.3f} ms at most")
+    else:
+        print()
+    if counts:
+        print("Injected "+", ".join(f"{key} {value}" for key, value in counts.items()))
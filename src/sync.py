@@ -0,0 +1,155 @@
+"""
+Module to search byte streams for the SYNC and RV header patterns
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import time
+
+import numpy as np
+
+# SYNC frames to identify minor frames
+SYNC = [64, 40, 107, 254]
+RV_HEADER = [114, 86, 48, 50, 65]
+
+def find_pattern(seq, pattern):
+    '''
+    Returns every index of seq where the bytes of pattern start
+
+    Works on the integer array directly: the first byte of the pattern picks the candidates and
+    every other byte of the pattern removes candidates, so no float correlation is needed
+    '''
+    seq = np.asarray(seq)
+    n = len(seq)-len(pattern)+1
+    if n <= 0:
+        return np.zeros(0, dtype=np.intp)
+
+    candidates = np.flatnonzero(seq[:n] == pattern[0])
+    for i in range(1, len(pattern)):
+        if len(candidates) == 0:
+            break
+        candidates = candidates[seq[candidates+i] == pattern[i]]
+    return candidates
+
+def find_SYNC(seq):
+    return find_pattern(seq, SYNC)
+
+def find_RV(seq):
+    return find_pattern(seq, RV_HEADER)
+
+# States of the sync lock
+SEARCHING = "searching"
+VERIFY = "verify"
+LOCKED = "locked"
+
+class SyncLock:
+    """
+    State machine that predicts where the next SYNC frames are instead of searching the whole batch
+
+    Every batch passed to find() must start where the last SYNC of the previous batch was found,
+    which is how the remaining bytes are carried between cycles in parse().
+
+    searching: the whole batch is searched with find_SYNC
+    verify:    the predicted positions matched, but not for enough batches to lock
+    locked:    only the predicted positions are checked, a missed SYNC goes back to searching
+    """
+    def __init__(self, packet_length, verify_batches=2, min_run=4, verbose=True):
+        self.packet_length = packet_length
+        self.verify_batches = verify_batches # Batches with all SYNC frames in place before locking
+        self.min_run = min_run               # SYNC frames in a row needed to start verifying
+        self.verbose = verbose
+        self.reset()
+
+    def reset(self):
+        self.state = SEARCHING
+        self.verified = 0
+        self.lock_events = 0
+        self.unlock_events = 0
+        self.frames = 0
+        self.locked_frames = 0
+
+    def predicted(self, data):
+        """
+        Check every packet_length bytes from the start of data for SYNC
+        Returns the predicted positions and a mask of the ones that matched
+        """
+        n = (len(data)-len(SYNC))//self.packet_length + 1
+        if n <= 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=bool)
+        match = np.ones(n, dtype=bool)
+        end = (n-1)*self.packet_length + 1
+        for i, byte in enumerate(SYNC):
+            match &= data[i:i+end:self.packet_length] == byte
+        return np.arange(0, end, self.packet_length), match
+
+    def find(self, data):
+        """
+        Returns the indices of the SYNC frames in data
+        """
+        if self.state != SEARCHING:
+            inds, match = self.predicted(data)
+            if match.all():
+                if self.state == LOCKED:
+                    self.locked_frames += len(inds)
+                else:
+                    self.verified += 1
+                    if self.verified >= self.verify_batches:
+                        self.state = LOCKED
+                        self.lock_events += 1
+                        if self.verbose:
+                            print("Sync locked")
+                self.frames += len(inds)
+                return inds
+
+            if self.state == LOCKED:
+                self.unlock_events += 1
+                if self.verbose:
+                    print("Sync lock lost")
+            self.state = SEARCHING
+
+        inds = find_SYNC(data)
+        self.frames += len(inds)
+
+        # The last SYNC frames must be evenly spaced to start predicting them
+        if len(inds) >= self.min_run and np.all(np.diff(inds[-self.min_run:]) == self.packet_length):
+            self.state = VERIFY
+            self.verified = 0
+        return inds
+
+    def lock_percentage(self):
+        if self.frames == 0:
+            return 0.0
+        return 100*self.locked_frames/self.frames
+
+    def stats(self):
+        return {"state": self.state,
+                "lock_events": self.lock_events,
+                "unlock_events": self.unlock_events,
+                "lock_percentage": self.lock_percentage()}
+
+if __name__ == "__main__":
+    # Compare against the correlation search that was used before
+    def find_correlate(seq, pattern):
+        arr = np.array(pattern)
+        candidates = np.where(np.correlate(seq, arr, mode='valid') == np.dot(arr, arr))[0]
+        check = candidates[:, np.newaxis] + np.arange(len(pattern))
+        mask = np.all((np.take(seq, check) == arr), axis=-1)
+        return candidates[mask]
+
+    PACKET_LENGTH = 2*40 + 44
+    rng = np.random.default_rng(0)
+    for num_frames in [1000, 5000, 20000]:
+        data = rng.integers(0, 256, num_frames*PACKET_LENGTH, dtype=np.uint8)
+        for i in range(len(SYNC)):
+            data[i::PACKET_LENGTH] = SYNC[i]
+
+        start_time = time.perf_counter()
+        old_inds = find_correlate(data.astype(np.float64), SYNC)
+        old_time = time.perf_counter()-start_time
+
+        start_time = time.perf_counter()
+        new_inds = find_SYNC(data)
+        new_time = time.perf_counter()-start_time
+
+        assert np.array_equal(old_inds, new_inds)
+        assert np.array_equal(find_correlate(data.astype(np.float64), RV_HEADER), find_RV(data))
+        print(f"{len(data)/1e6:6.2f} MB   correlate {old_time*1e3:8.2f} ms   byte search {new_time*1e3:6.2f} ms   speedup {old_time/new_time:6.1f}x")
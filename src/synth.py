@@ -0,0 +1,202 @@
+"""
+Module to make synthetic telemetry for benchmarks and replay tests
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import numpy as np
+
+from crc import crc_16_rows, RV_CRC_LEN
+
+MINFRAME_LEN = 2 * 40
+PACKET_LENGTH = MINFRAME_LEN + 44
+SYNC = [64, 40, 107, 254]
+RV_HEADER = [114, 86, 48, 50, 65]
+RV_LEN = 48
+PROTOCOLS = ['all', 'odd frame', 'even frame', 'odd sfid', 'even sfid']
+
+# Columns of the minor frames after swapping endianness
+COUNTER_COL = 5
+FRAME_TYPE_COL = 57
+GPS_COLS = [6, 26, 46, 66] # The byte after each one is 128 when it holds a gps byte
+
+# (name, protocol, board id, columns, masks), 8 bit boards send one byte per column and 4 bit boards one nibble
+HK_BOARDS = [("PIP", "all", 34, [36, 37], [255, 255]),
+             ("mNLP", "all", 18, [21], [255]),
+             ("ACC", "even frame", 51, [63], [255]),
+             ("EFP", "all", 131, [39], [15])]
+
+# WGS84
+WGS84_A = 6378137.0
+WGS84_E2 = 6.69437999014e-3
+
+def geodetic2ecef(lat, lon, alt):
+    lat, lon = np.radians(lat), np.radians(lon)
+    n = WGS84_A/np.sqrt(1-WGS84_E2*np.sin(lat)**2)
+    return ((n+alt)*np.cos(lat)*np.cos(lon),
+            (n+alt)*np.cos(lat)*np.sin(lon),
+            (n*(1-WGS84_E2)+alt)*np.sin(lat))
+
+def enu2ecefv(veast, vnorth, vup, lat, lon):
+    lat, lon = np.radians(lat), np.radians(lon)
+    return (-np.sin(lon)*veast - np.sin(lat)*np.cos(lon)*vnorth + np.cos(lat)*np.cos(lon)*vup,
+             np.cos(lon)*veast - np.sin(lat)*np.sin(lon)*vnorth + np.cos(lat)*np.sin(lon)*vup,
+             np.cos(lat)*vnorth + np.sin(lat)*vup)
+
+def rv_packets(lat, lon, alt, veast, vnorth, vup, numsats):
+    """
+    RV packets with a correct checksum for arrays of gps values, as a (packets, RV_LEN) uint8 matrix
+    """
+    n = len(lat)
+    packets = np.zeros((n, RV_LEN), dtype=np.uint8)
+    packets[:, :len(RV_HEADER)] = RV_HEADER
+
+    # Positions are 40 bit signed 1/10000 m, most significant byte first then the least significant byte
+    for axis, cols in zip(geodetic2ecef(lat, lon, alt), [[12, 11, 10, 9, 16], [20, 19, 18, 17, 24], [28, 27, 26, 25, 32]]):
+        value = np.round(axis*10000).astype(np.int64) % (1 << 40)
+        for i, col in enumerate(cols):
+            packets[:, col] = (value >> (32-8*i)) & 0xFF
+
+    # Velocities are 28 bit signed 1/10000 m/s, the last 4 bits are the top of the first byte
+    for axis, cols in zip(enu2ecefv(veast, vnorth, vup, lat, lon), [[36, 35, 34, 33], [40, 39, 38, 37], [44, 43, 42, 41]]):
+        value = np.round(axis*10000).astype(np.int64) % (1 << 28)
+        packets[:, cols[0]] = (value >> 20) & 0xFF
+        packets[:, cols[1]] = (value >> 12) & 0xFF
+        packets[:, cols[2]] = (value >> 4) & 0xFF
+        packets[:, cols[3]] = (value & 0xF) << 4
+
+    packets[:, 15] = numsats & 0x1F
+    crc = crc_16_rows(packets[:, :RV_CRC_LEN])
+    packets[:, RV_CRC_LEN] = crc & 0xFF
+    packets[:, RV_CRC_LEN+1] = crc >> 8
+    return packets
+
+class TelemetrySynth:
+    """
+    Makes a continuous stream of valid packets
+
+    Each packet is a minor frame starting with SYNC and PACKET_LENGTH-MINFRAME_LEN random bytes. Frames alternate
+    between odd and even, the frame counter counts up, gps_slots of the gps columns carry a stream of RV packets and
+    the housekeeping boards carry their packets in their columns of the frames of their protocol.
+    Every other column is filled by channels, which are (name, protocol, signed, columns, masks) like the format file.
+    Consecutive calls to packets() continue the same stream.
+    """
+    def __init__(self, num_channels=8, hk_boards=HK_BOARDS, gps_slots=1, gps_rate=10, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.hk_boards = list(hk_boards)
+        self.gps_slots = gps_slots
+        self.gps_rate = gps_rate # Packets per second of flight time
+
+        used = {0, 1, 2, 3, COUNTER_COL, FRAME_TYPE_COL}
+        for col in GPS_COLS:
+            used |= {col, col+1}
+        for board in self.hk_boards:
+            used |= set(board[3])
+        free = [col for col in range(MINFRAME_LEN) if col not in used]
+
+        # Channels are one or two bytes and share the free columns when there are more channels than columns
+        self.channels = []
+        for i in range(num_channels):
+            protocol = PROTOCOLS[i % 3]
+            if i % 2 == 0:
+                self.channels.append((f"CH{i}", protocol, False, [free[i % len(free)]], [255]))
+            else:
+                self.channels.append((f"CH{i}", protocol, True, [free[i % len(free)], free[(i+1) % len(free)]], [255, 240]))
+        self.channel_cols = free
+
+        self.count = 0 # Frames made so far
+        self.gps_pending = np.zeros(0, dtype=np.uint8)
+        self.gps_count = 0
+        self.hk_pending = [np.zeros(0, dtype=np.uint8) for board in self.hk_boards]
+
+    def gps_bytes(self, n):
+        """
+        The next n bytes of the gps stream
+        """
+        while len(self.gps_pending) < n:
+            num = max(64, (n-len(self.gps_pending))//RV_LEN+1)
+            t = (self.gps_count+np.arange(num))/self.gps_rate
+            self.gps_count += num
+            lat = 69.29+0.0001*t
+            lon = 16.03+0.0002*t
+            alt = 10+100*t
+            packets = rv_packets(lat, lon, alt, np.full(num, 5.0), np.full(num, 3.0), np.full(num, 100.0), np.full(num, 9))
+            self.gps_pending = np.concatenate([self.gps_pending, packets.ravel()])
+        data, self.gps_pending = self.gps_pending[:n], self.gps_pending[n:]
+        return data
+
+    def hk_bytes(self, board_ind, n):
+        """
+        The next n bytes, or nibbles for 4 bit boards, of the stream of a housekeeping board
+        """
+        name, protocol, board_id, cols, masks = self.hk_boards[board_ind]
+        while len(self.hk_pending[board_ind]) < n:
+            num = n//10+1
+            # Values never equal the board id so packets are only found at the board id
+            values = self.rng.integers(0, 255, (num, 10), dtype=np.uint8)
+            if masks[0] == 255:
+                values[values == board_id] += 1
+                packets = np.concatenate([np.full((num, 1), board_id, dtype=np.uint8), values], axis=1)
+            else:
+                nibbles = np.stack([values >> 4, values & 0xF], axis=2).reshape(num, 20)
+                packets = np.concatenate([np.tile([board_id >> 4, board_id & 0xF], (num, 1)).astype(np.uint8), nibbles], axis=1)
+            self.hk_pending[board_ind] = np.concatenate([self.hk_pending[board_ind], packets.ravel()])
+        data, self.hk_pending[board_ind] = self.hk_pending[board_ind][:n], self.hk_pending[board_ind][n:]
+        return data
+
+    def packets(self, n):
+        """
+        The next n packets as a uint8 array of n*PACKET_LENGTH bytes
+        """
+        counter = (self.count+np.arange(n)) % 256
+        frame_type = np.where((self.count+np.arange(n)) % 2 == 0, 1, 2)
+        self.count += n
+
+        frames = np.zeros((n, MINFRAME_LEN), dtype=np.uint8)
+        frames[:, self.channel_cols] = self.rng.integers(0, 256, (n, len(self.channel_cols)), dtype=np.uint8)
+        frames[:, :4] = SYNC[::-1]
+        frames[:, COUNTER_COL] = counter
+        frames[:, FRAME_TYPE_COL] = frame_type
+
+        gps_cols = GPS_COLS[:self.gps_slots]
+        if gps_cols:
+            frames[:, gps_cols] = self.gps_bytes(n*len(gps_cols)).reshape(n, len(gps_cols))
+            frames[:, [col+1 for col in gps_cols]] = 128
+
+        rows = [np.ones(n, dtype=bool), frame_type == 1, frame_type == 2, counter % 2 == 1, counter % 2 == 0]
+        for board_ind, (name, protocol, board_id, cols, masks) in enumerate(self.hk_boards):
+            board_rows = np.flatnonzero(rows[PROTOCOLS.index(protocol)])
+            data = self.hk_bytes(board_ind, len(board_rows)*len(cols)).reshape(len(board_rows), len(cols))
+            frames[np.ix_(board_rows, cols)] = data
+
+        packets = np.zeros((n, PACKET_LENGTH), dtype=np.uint8)
+        # Swapping the endianness back gives the bytes as they are sent
+        packets[:, :MINFRAME_LEN] = frames.view(np.uint32).byteswap().view(np.uint8)
+        packets[:, MINFRAME_LEN:] = self.rng.integers(0, 256, (n, PACKET_LENGTH-MINFRAME_LEN), dtype=np.uint8)
+        return packets.ravel()
+
+    def write_recording(self, file_name, num_packets, chunk=50000):
+        with open(file_name, "wb") as f:
+            for start in range(0, num_packets, chunk):
+                self.packets(min(chunk, num_packets-start)).tofile(f)
+
+    def write_format(self, file_name, bytes_ps, numpoints=5000):
+        """
+        Write an excel format file with the channels and housekeeping boards for parsing.init()
+        """
+        from openpyxl import Workbook
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet["D3"] = bytes_ps
+
+        first = 20
+        for row, (name, protocol, signed, cols, masks) in enumerate(self.channels, first):
+            for col, value in zip("CDEFG", [name, protocol, signed, ";".join(map(str, cols)), ";".join(map(str, masks))]):
+                sheet[f"{col}{row}"] = value
+        sheet["D7"] = f"{first};{first+len(self.channels)-1}"
+
+        first = first+len(self.channels)+2
+        for row, (name, protocol, board_id, cols, masks) in enumerate(self.hk_boards, first):
+            for col, value in zip("CDEFGH", [name, numpoints, protocol, board_id, ";".join(map(str, cols)), ";".join(map(str, masks))]):
+                sheet[f"{col}{row}"] = value
+        sheet["D9"] = f"{first};{first+len(self.hk_boards)-1}"
+        workbook.save(file_name)
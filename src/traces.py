@@ -0,0 +1,213 @@
+"""
+Module with a vispy visual for channel histories that stay on the GPU
+
+Each trace keeps its y values in a vertex buffer that is written like a CircularBuffer: every cycle only the
+slots of the new values are uploaded with set_subdata. The x of every slot comes from one index buffer that
+all traces of a graph share, and the vertex shader turns a slot into its position in the history with the
+cursor of the buffer, so nothing has to be moved or uploaded when the history scrolls.
+
+When more values are visible than the plot has pixel columns, the trace draws the min and max of every
+column as a vertical line instead of every value (level of detail). The columns come from a MinMaxDecimator
+that is updated with the new values every cycle and only computed again when the zoom changes.
+
+Written for the Space and Atmospheric Instrumentation Laboratory at ERAU
+"""
+import numpy as np
+
+from vispy import gloo
+from vispy.color import Color
+from vispy.visuals import Visual, CompoundVisual
+from vispy.scene.visuals import create_visual_node
+
+from buffers import CircularBuffer
+from decimate import MinMaxDecimator
+
+MIN_STEP = 2 # Values per pixel column before the min and max are drawn instead of every value
+
+POINTS_VERT_SHADER = """
+attribute float a_index; // Slot of the value in the buffer, shared by the traces of a graph
+attribute float a_y;
+uniform float u_cursor;  // Slot of the oldest value
+uniform float u_length;
+uniform float u_size;
+
+void main() {
+    // The oldest value is drawn at x = 0 and the newest at x = u_length-1
+    float x = mod(a_index-u_cursor+u_length, u_length);
+    gl_Position = $transform(vec4(x, a_y, 0, 1));
+    gl_PointSize = u_size;
+}
+"""
+
+ENVELOPE_VERT_SHADER = """
+attribute vec2 a_bin;    // Slot of the bin, -0.5 for its min and 0.5 for its max
+attribute float a_y;
+uniform float u_cursor;  // Slot of the oldest bin
+uniform float u_bins;
+uniform float u_step;    // Values in each bin
+uniform float u_offset;  // Position in the history of the oldest bin
+uniform float u_pixel;   // Height of a pixel, so a bin is always at least one pixel tall
+
+void main() {
+    float x = mod(a_bin.x-u_cursor+u_bins, u_bins)*u_step+u_offset+(u_step-1.0)/2.0;
+    gl_Position = $transform(vec4(x, a_y+a_bin.y*u_pixel, 0, 1));
+}
+"""
+
+FRAG_SHADER = """
+uniform vec4 u_color;
+
+void main() {
+    gl_FragColor = u_color;
+}
+"""
+
+def index_buffer(length):
+    """
+    Vertex buffer of the slots 0 to length-1, made once per graph and passed to all of its traces
+    """
+    return gloo.VertexBuffer(np.arange(length, dtype=np.float32))
+
+class PointsVisual(Visual):
+    """
+    Every value of a CircularBuffer history drawn as a point at its position in the history
+    """
+    def __init__(self, history, index, color, size):
+        Visual.__init__(self, vcode=POINTS_VERT_SHADER, fcode=FRAG_SHADER)
+        self.history = history
+        self.y = gloo.VertexBuffer(history.data)
+        self.shared_program['a_index'] = index
+        self.shared_program['a_y'] = self.y
+        self.shared_program['u_cursor'] = 0.0
+        self.shared_program['u_length'] = float(len(history))
+        self.shared_program['u_size'] = float(size)
+        self.shared_program['u_color'] = Color(color).rgba
+        self._draw_mode = 'points'
+
+    def upload(self, written):
+        """
+        Upload the (start, end) slots of the history that were written
+        """
+        for start, end in written:
+            self.y.set_subdata(self.history.data[start:end], offset=start)
+        self.shared_program['u_cursor'] = float(self.history.cursor)
+
+    def _prepare_transforms(self, view):
+        view.view_program.vert['transform'] = view.get_transform()
+
+    def _prepare_draw(self, view):
+        return True
+
+class EnvelopeVisual(Visual):
+    """
+    The bins of a MinMaxDecimator drawn as a vertical line from the min to the max of each bin
+    """
+    def __init__(self, color):
+        Visual.__init__(self, vcode=ENVELOPE_VERT_SHADER, fcode=FRAG_SHADER)
+        self.decimator = None
+        self.bin = gloo.VertexBuffer(np.zeros((2, 2), dtype=np.float32))
+        self.y = gloo.VertexBuffer(np.zeros(2, dtype=np.float32))
+        self.shared_program['a_bin'] = self.bin
+        self.shared_program['a_y'] = self.y
+        self.shared_program['u_pixel'] = 0.0
+        self.shared_program['u_color'] = Color(color).rgba
+        self._draw_mode = 'lines'
+
+    def set_decimator(self, decimator):
+        """
+        Upload every bin of a decimator, after it was made or its step changed
+        """
+        self.decimator = decimator
+        bins = np.empty((decimator.num_bins, 2, 2), dtype=np.float32)
+        bins[:, :, 0] = np.arange(decimator.num_bins)[:, None]
+        bins[:, :, 1] = [-0.5, 0.5]
+        self.bin.set_data(bins.reshape(-1, 2))
+        self.y.set_data(decimator.envelope.ravel())
+        self.shared_program['u_bins'] = float(decimator.num_bins)
+        self.shared_program['u_step'] = float(decimator.step)
+        self.upload([])
+
+    def upload(self, written):
+        """
+        Upload the (start, end) bins of the decimator that changed
+        """
+        for start, end in written:
+            self.y.set_subdata(self.decimator.envelope[start:end].ravel(), offset=2*start)
+        self.shared_program['u_cursor'] = float(self.decimator.bins.cursor)
+        self.shared_program['u_offset'] = float(self.decimator.offset())
+
+    def _prepare_transforms(self, view):
+        view.view_program.vert['transform'] = view.get_transform()
+
+    def _prepare_draw(self, view):
+        return self.decimator is not None
+
+class TraceVisual(CompoundVisual):
+    """
+    History of the last length values of a channel, drawn as points or as the min and max of each pixel column
+
+    write() adds values like CircularBuffer.write() and only uploads the slots that changed.
+    set_view() picks the level of detail from the visible range, which ScrollingPlotWidget calls when it zooms.
+    The values are also kept in history on the CPU.
+    """
+    def __init__(self, length, index=None, color="#000000", size=1):
+        self.length = int(length)
+        self.history = CircularBuffer(self.length, dtype=np.float32)
+        self.decimator = None
+        self._points = PointsVisual(self.history, index if index is not None else index_buffer(self.length), color, size)
+        self._envelope = EnvelopeVisual(color)
+        self._envelope.visible = False
+        CompoundVisual.__init__(self, [self._points, self._envelope])
+        self.set_gl_state(depth_test=False)
+
+    def write(self, values):
+        """
+        Add values to the end of the history and upload only the slots they were written to
+        """
+        values = np.asarray(values, dtype=np.float32)
+        self._points.upload(self.history.write(values))
+        if self.decimator is not None:
+            self._envelope.upload(self.decimator.write(values))
+        self.update()
+
+    def set_view(self, visible, pixels, pixel_height=0.0):
+        """
+        Draw every value when there are fewer than MIN_STEP visible values per pixel column, otherwise the
+        min and max of each column. visible is the width of the visible range in values and pixel_height
+        the height of a pixel in y units.
+        The step is a power of two so zooming only computes the bins again when it changes by 2 times.
+        """
+        step = visible/max(pixels, 1)
+        if step < MIN_STEP:
+            if self.decimator is not None:
+                self.decimator = None
+                self._envelope.visible = False
+                self._points.visible = True
+            return
+        step = 1 << int(np.log2(step))
+        if self.decimator is None:
+            self.decimator = MinMaxDecimator(self.history, step)
+            self._envelope.set_decimator(self.decimator)
+        elif step != self.decimator.step:
+            self.decimator.set_step(step)
+            self._envelope.set_decimator(self.decimator)
+        self._envelope.shared_program['u_pixel'] = float(pixel_height)
+        self._envelope.visible = True
+        self._points.visible = False
+
+    def reset(self):
+        self.history.fill(0)
+        self._points.upload([(0, self.length)])
+        if self.decimator is not None:
+            self.decimator = MinMaxDecimator(self.history, self.decimator.step)
+            self._envelope.set_decimator(self.decimator)
+        self.update()
+
+    def _compute_bounds(self, axis, view):
+        if axis == 0:
+            return 0, self.length-1
+        if axis == 1:
+            return float(self.history.data.min()), float(self.history.data.max())
+        return 0, 0
+
+Trace = create_visual_node(TraceVisual)